@@ -3,13 +3,15 @@ Authentication API endpoints.
 """
 import logging
 from datetime import timedelta
+import anyio
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordRequestForm
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.core.security import verify_password, create_access_token
-from app.db.session import get_db
+from app.core.security import verify_and_update_password, create_access_token, invalidate_user
+from app.db.session import get_async_db
 from app.schemas.token import Token
 from app.models.user import User
 
@@ -25,14 +27,14 @@ logger = logging.getLogger(__name__)
 )
 async def login_for_access_token(
     form_data: OAuth2PasswordRequestForm = Depends(),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
     """
     Create an access token for API authentication.
     
     Args:
         form_data: The OAuth2 password request form
-        db: Database session
+        db: Async database session
     
     Returns:
         Token: The access token
@@ -41,11 +43,19 @@ async def login_for_access_token(
         HTTPException: If authentication fails
     """
     # Find the user by email
-    user = db.query(User).filter(User.email == form_data.username).first()
+    result = await db.execute(select(User).where(User.email == form_data.username))
+    user = result.scalar_one_or_none()
     
-    # Check if the user exists and the password is correct
-    if not user or not verify_password(form_data.password, user.hashed_password):
-        logger.warning(f"Failed login attempt for user: {form_data.username}")
+    # Check if the user exists and the password is correct; hashing is
+    # CPU-bound, so verify in a worker thread to keep the event loop free
+    verified, new_hash = False, None
+    if user:
+        verified, new_hash = await anyio.to_thread.run_sync(
+            verify_and_update_password, form_data.password, user.hashed_password
+        )
+    
+    if not verified:
+        logger.warning("Failed login attempt for user: %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect email or password",
@@ -54,13 +64,20 @@ async def login_for_access_token(
     
     # Check if the user is active
     if not user.is_active:
-        logger.warning(f"Login attempt for inactive user: {form_data.username}")
+        logger.warning("Login attempt for inactive user: %s", form_data.username)
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Inactive user",
             headers={"WWW-Authenticate": "Bearer"},
         )
     
+    # Upgrade outdated hashes (e.g. bcrypt) now that we have the password
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
+        invalidate_user(user.id)
+        logger.info("Upgraded password hash for user: %s", form_data.username)
+    
     # Create the access token
     access_token_expires = timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
     access_token = create_access_token(
@@ -68,7 +85,7 @@ async def login_for_access_token(
         expires_delta=access_token_expires
     )
     
-    logger.info(f"Successful login for user: {form_data.username}")
+    logger.info("Successful login for user: %s", form_data.username)
     return Token(
         access_token=access_token,
         token_type="bearer"
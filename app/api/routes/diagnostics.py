@@ -0,0 +1,260 @@
+"""
+Diagnostics API endpoints.
+
+Only mounted when DEBUG or ENABLE_DIAGNOSTICS is set, since the checks
+call out to Apple and the database on every request.
+"""
+import asyncio
+import logging
+import os
+import sys
+from importlib.metadata import PackageNotFoundError, version
+from typing import Optional
+from cryptography.hazmat.primitives.asymmetric import ec
+from fastapi import APIRouter, status
+from pydantic import BaseModel
+from sqlalchemy import text
+
+from app.core.apple_jws import get_apple_public_keys
+from app.core.apple_keys import get_apple_private_key
+from app.core.config import settings
+from app.db.session import engine
+from app.services.apple_service import AppleService
+
+router = APIRouter()
+logger = logging.getLogger(__name__)
+
+
+class ConnectionTestResponse(BaseModel):
+    """Response model for the connection test endpoint."""
+    status: str
+    message: str
+
+
+def _safe_version(package: str) -> Optional[str]:
+    """
+    Get an installed package's version.
+    
+    Args:
+        package: The distribution name
+        
+    Returns:
+        Optional[str]: The version, or None if the package isn't installed
+    """
+    try:
+        return version(package)
+    except PackageNotFoundError:
+        return None
+
+
+# Versions of the critical dependencies, read once at import
+_DEP_VERSIONS = {
+    package: _safe_version(package)
+    for package in ("fastapi", "uvicorn", "sqlalchemy", "psycopg2", "pyjwt", "cryptography")
+}
+
+
+def _db_probe() -> dict:
+    """
+    Check that the database answers a trivial query.
+    
+    Blocks on the sync engine, so callers run it in a worker thread.
+    
+    Returns:
+        dict: The database details for the diagnostics response
+    """
+    try:
+        with engine.connect() as conn:
+            result = conn.execute(text("SELECT 1"))
+            database_ok = result.scalar() == 1
+            
+        return {
+            "connected": database_ok,
+            "type": settings.DATABASE_URL.split("://")[0] if settings.DATABASE_URL else "unknown"
+        }
+    except Exception as e:
+        return {
+            "connected": False,
+            "error": str(e)
+        }
+
+
+def _apple_probe() -> dict:
+    """
+    Check that an App Store Server API token can be signed.
+    
+    Reads the private key file on first use, so callers run it in a worker thread.
+    
+    Returns:
+        dict: The Apple API details for the diagnostics response
+    """
+    try:
+        token = AppleService().generate_token()
+        return {
+            "token_generated": bool(token),
+            "environment": settings.APPLE_ENVIRONMENT
+        }
+    except Exception as e:
+        return {
+            "token_generated": False,
+            "error": str(e)
+        }
+
+
+@router.get("/diagnostics")
+async def system_diagnostics():
+    """Check configuration, dependencies, the database and Apple API signing."""
+    diagnostics = {
+        "status": "ok",
+        "details": {},
+        "environment": {},
+        "dependencies": {}
+    }
+    
+    # Check environment variables
+    apple_env_vars = {
+        "APPLE_TEAM_ID": settings.APPLE_TEAM_ID,
+        "APPLE_BUNDLE_ID": settings.APPLE_BUNDLE_ID,
+        "APPLE_ENVIRONMENT": settings.APPLE_ENVIRONMENT,
+        "APPLE_PRIVATE_KEY_ID": settings.APPLE_PRIVATE_KEY_ID,
+        "APPLE_ISSUER_ID": settings.APPLE_ISSUER_ID,
+    }
+    
+    diagnostics["environment"] = {
+        "python_version": sys.version,
+        "apple_config_set": all(apple_env_vars.values()),
+        "database_url_set": bool(settings.DATABASE_URL),
+        "debug_mode": settings.DEBUG,
+    }
+    
+    # Check for key file
+    key_path = settings.APPLE_PRIVATE_KEY_PATH
+    key_exists = os.path.isfile(key_path) if key_path else False
+    diagnostics["details"]["key_file"] = {
+        "path": key_path,
+        "exists": key_exists
+    }
+    
+    # Check critical dependencies
+    for package, package_version in _DEP_VERSIONS.items():
+        diagnostics["dependencies"][package] = {
+            "installed": package_version is not None,
+            "version": package_version
+        }
+        if package_version is None:
+            diagnostics["status"] = "warning"
+    
+    # The database and Apple probes are independent, so run them concurrently
+    # off the event loop; the Apple probe only needs the key and dependencies
+    probes = [asyncio.to_thread(_db_probe)]
+    run_apple_probe = key_exists and diagnostics["status"] == "ok"
+    if run_apple_probe:
+        probes.append(asyncio.to_thread(_apple_probe))
+    results = await asyncio.gather(*probes)
+    
+    diagnostics["details"]["database"] = results[0]
+    if not results[0]["connected"]:
+        diagnostics["status"] = "warning"
+    
+    if run_apple_probe:
+        diagnostics["details"]["apple_api"] = results[1]
+        if not results[1]["token_generated"]:
+            diagnostics["status"] = "warning"
+    
+    return diagnostics
+
+
+@router.get(
+    "/test-connection",
+    response_model=ConnectionTestResponse,
+    status_code=status.HTTP_200_OK,
+    summary="Test Apple connection and configuration"
+)
+async def test_apple_connection():
+    """
+    Test the connection to Apple's servers and verify configuration.
+    
+    This endpoint checks:
+    1. That the required Apple configuration is present
+    2. That we can fetch Apple's public keys
+    3. That the private key can be loaded and parsed (if configured)
+    
+    Returns:
+        ConnectionTestResponse: Connection test results
+    """
+    try:
+        # 1. Check for required configuration
+        missing_configs = []
+        required_configs = [
+            ("APPLE_PRIVATE_KEY_ID", settings.APPLE_PRIVATE_KEY_ID),
+            ("APPLE_TEAM_ID", settings.APPLE_TEAM_ID),
+            ("APPLE_BUNDLE_ID", settings.APPLE_BUNDLE_ID),
+            ("APPLE_ISSUER_ID", settings.APPLE_ISSUER_ID)
+        ]
+        
+        for name, value in required_configs:
+            if not value:
+                missing_configs.append(name)
+                
+        if missing_configs:
+            return ConnectionTestResponse(
+                status="error",
+                message=f"Missing required Apple configuration: {', '.join(missing_configs)}"
+            )
+        
+        # 2. Test fetching Apple's public keys
+        try:
+            public_keys = await get_apple_public_keys()
+            if not public_keys:
+                return ConnectionTestResponse(
+                    status="error",
+                    message="Could not fetch Apple public keys. Check your internet connection."
+                )
+            logger.info("Successfully fetched %d Apple public keys", len(public_keys))
+        except Exception as e:
+            logger.error("Error fetching Apple public keys: %s", e)
+            return ConnectionTestResponse(
+                status="error",
+                message=f"Error connecting to Apple servers: {str(e)}"
+            )
+        
+        # 3. Check private key (if path is configured)
+        if settings.APPLE_PRIVATE_KEY_PATH:
+            try:
+                private_key = get_apple_private_key()
+            except OSError as e:
+                logger.error("Error reading private key file: %s", e)
+                return ConnectionTestResponse(
+                    status="error",
+                    message=f"Could not read private key file: {str(e)}"
+                )
+            except (ValueError, TypeError) as e:
+                logger.error("Error parsing private key file: %s", e)
+                return ConnectionTestResponse(
+                    status="warning",
+                    message="Private key file exists but may not be a valid private key."
+                )
+            # App Store Connect keys are P-256 EC keys
+            if not isinstance(private_key, ec.EllipticCurvePrivateKey):
+                return ConnectionTestResponse(
+                    status="warning",
+                    message="Private key is not an EC key, so it cannot sign ES256 requests."
+                )
+        else:
+            return ConnectionTestResponse(
+                status="warning",
+                message="Private key path not configured. JWS signing will not work."
+            )
+        
+        # All checks passed
+        return ConnectionTestResponse(
+            status="success",
+            message="Successfully connected to Apple servers and verified configuration."
+        )
+        
+    except Exception as e:
+        logger.error("Error testing Apple connection: %s", e)
+        return ConnectionTestResponse(
+            status="error",
+            message=f"Error testing Apple connection: {str(e)}"
+        )
@@ -4,11 +4,11 @@ Subscriptions API endpoints.
 import logging
 from typing import List
 from uuid import UUID
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
+from fastapi import APIRouter, Depends, HTTPException, Response, status
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.security import get_current_user
-from app.db.session import get_db
+from app.db.session import get_async_db
 from app.models.user import User
 from app.schemas.subscription import Subscription, SubscriptionStatus
 from app.services.subscription_service import SubscriptionService
@@ -16,6 +16,18 @@ from app.services.subscription_service import SubscriptionService
 router = APIRouter()
 logger = logging.getLogger(__name__)
 
+def get_subscription_service(db: AsyncSession = Depends(get_async_db)) -> SubscriptionService:
+    """
+    Get a subscription service bound to the request's database session.
+    
+    Args:
+        db: Async database session
+    
+    Returns:
+        SubscriptionService: The subscription service
+    """
+    return SubscriptionService(db)
+
 
 @router.get(
     "/subscriptions/status/{user_id}",
@@ -26,7 +38,8 @@ logger = logging.getLogger(__name__)
 )
 async def get_subscription_status(
     user_id: UUID,
-    db: Session = Depends(get_db),
+    include_raw_data: bool = False,
+    subscription_service: SubscriptionService = Depends(get_subscription_service),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -34,7 +47,8 @@ async def get_subscription_status(
     
     Args:
         user_id: The user ID to check
-        db: Database session
+        include_raw_data: Include each subscription's raw Apple payload
+        subscription_service: Subscription service for the request
         current_user: The authenticated user
     
     Returns:
@@ -44,15 +58,20 @@ async def get_subscription_status(
         HTTPException: If user is not found or not authorized
     """
     # Check authorization (only allow users to check their own status or superusers)
-    if str(current_user.id) != str(user_id) and not current_user.is_superuser:
-        logger.warning(f"Unauthorized access attempt to subscription status for user {user_id}")
+    if current_user.id != user_id and not current_user.is_superuser:
+        logger.warning("Unauthorized access attempt to subscription status for user %s", user_id)
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to access this user's subscription data"
         )
     
-    subscription_service = SubscriptionService(db)
-    return await subscription_service.get_user_subscription_status(user_id)
+    subscription_status = await subscription_service.get_user_subscription_status(user_id, include_raw_data)
+    # Returning a Response skips FastAPI's response_model validation and
+    # encoding; response_model is kept for the OpenAPI schema
+    return Response(
+        content=subscription_status.model_dump_json(),
+        media_type="application/json"
+    )
 
 
 @router.get(
@@ -64,7 +83,8 @@ async def get_subscription_status(
 )
 async def get_active_subscriptions(
     user_id: UUID,
-    db: Session = Depends(get_db),
+    include_raw_data: bool = False,
+    subscription_service: SubscriptionService = Depends(get_subscription_service),
     current_user: User = Depends(get_current_user)
 ):
     """
@@ -72,7 +92,8 @@ async def get_active_subscriptions(
     
     Args:
         user_id: The user ID to check
-        db: Database session
+        include_raw_data: Include each subscription's raw Apple payload
+        subscription_service: Subscription service for the request
         current_user: The authenticated user
     
     Returns:
@@ -82,12 +103,11 @@ async def get_active_subscriptions(
         HTTPException: If user is not found or not authorized
     """
     # Check authorization (only allow users to check their own subscriptions or superusers)
-    if str(current_user.id) != str(user_id) and not current_user.is_superuser:
-        logger.warning(f"Unauthorized access attempt to active subscriptions for user {user_id}")
+    if current_user.id != user_id and not current_user.is_superuser:
+        logger.warning("Unauthorized access attempt to active subscriptions for user %s", user_id)
         raise HTTPException(
             status_code=status.HTTP_403_FORBIDDEN,
             detail="Not authorized to access this user's subscription data"
         )
     
-    subscription_service = SubscriptionService(db)
-    return await subscription_service.get_user_active_subscriptions(user_id)
+    return await subscription_service.get_user_active_subscriptions(user_id, include_raw_data)
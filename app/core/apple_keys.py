@@ -0,0 +1,40 @@
+"""
+Apple private key loading module.
+
+This module loads the App Store Connect private key used to sign requests to Apple.
+"""
+import logging
+from functools import lru_cache
+
+from cryptography.hazmat.primitives.asymmetric.types import PrivateKeyTypes
+from cryptography.hazmat.primitives.serialization import load_pem_private_key
+
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+
+@lru_cache(maxsize=1)
+def get_apple_private_key() -> PrivateKeyTypes:
+    """
+    Load and parse the Apple private key configured in APPLE_PRIVATE_KEY_PATH.
+
+    The file is read and parsed once; the key object is cached for reuse by
+    all signing. Failures are not cached, so a fixed key file is picked up
+    on the next call.
+
+    Returns:
+        PrivateKeyTypes: The parsed private key
+
+    Raises:
+        ValueError: If no key path is configured or the file is not a valid PEM private key
+        OSError: If the key file cannot be read
+    """
+    if not settings.APPLE_PRIVATE_KEY_PATH:
+        raise ValueError("APPLE_PRIVATE_KEY_PATH is not configured")
+
+    with open(settings.APPLE_PRIVATE_KEY_PATH, "rb") as key_file:
+        private_key = load_pem_private_key(key_file.read(), password=None)
+
+    logger.info("Loaded Apple private key from %s", settings.APPLE_PRIVATE_KEY_PATH)
+    return private_key
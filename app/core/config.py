@@ -4,9 +4,10 @@ Loads environment variables and provides application configuration.
 """
 import os
 import logging
+from functools import lru_cache
 from typing import List, Optional, Dict, Any
-from pydantic import Field, validator
-from pydantic_settings import BaseSettings
+from pydantic import Field, field_validator
+from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
 class Settings(BaseSettings):
@@ -22,15 +23,49 @@ class Settings(BaseSettings):
     # Server settings
     HOST: str = Field(default="0.0.0.0")
     PORT: int = Field(default=8000)
+    # Worker processes when run directly; password hashing is CPU-bound,
+    # so size this to the available cores
+    WORKERS: int = Field(default=1)
     ALLOWED_ORIGINS: List[str] = Field(default_factory=lambda: ["*"])
+    # Mount the /test-connection and /diagnostics endpoints outside DEBUG;
+    # they call Apple and the database on every request
+    ENABLE_DIAGNOSTICS: bool = Field(default=False)
     
     # Security
     SECRET_KEY: str = Field(...)
     ACCESS_TOKEN_EXPIRE_MINUTES: int = Field(default=60 * 24)  # 1 day
     ALGORITHM: str = Field(default="HS256")
+    # Encode and decode access tokens with PyJWT instead of python-jose;
+    # tokens are interchangeable, so this can be rolled out gradually
+    USE_PYJWT: bool = Field(default=False)
+    # Argon2id password hashing cost, tuned for ~250ms per hash; existing
+    # hashes are rehashed with new values on the user's next login
+    ARGON2_MEMORY_COST: int = Field(default=65536)  # KiB
+    ARGON2_TIME_COST: int = Field(default=3)
+    ARGON2_PARALLELISM: int = Field(default=4)
 
     # Database
     DATABASE_URL: str = Field(...)
+    # Connection pool per engine (the app runs a sync and an async engine per
+    # worker, so keep pool size + overflow times two under max_connections)
+    DB_POOL_SIZE: int = Field(default=10)
+    DB_MAX_OVERFLOW: int = Field(default=20)
+    DB_POOL_TIMEOUT: int = Field(default=30)  # seconds
+    DB_POOL_RECYCLE: int = Field(default=300)  # seconds
+    # Name shown for the service's connections in pg_stat_activity
+    DB_APPLICATION_NAME: str = Field(default="apple-webhook")
+    # PostgreSQL JIT; off by default since it slows down short OLTP queries
+    DB_JIT: bool = Field(default=False)
+    # Prepared statements cached per asyncpg connection, by asyncpg and by
+    # SQLAlchemy's dialect; 0 turns both off and gives statements unique
+    # names, as needed behind PgBouncer in transaction pooling mode
+    DB_STATEMENT_CACHE_SIZE: int = Field(default=1024)
+    # Optional zstd dictionary for compressing stored raw payloads; once rows
+    # are written with a dictionary it must stay available to read them
+    RAW_DATA_ZSTD_DICT_PATH: Optional[str] = None
+    # Create missing tables when the app starts. Once the schema exists this
+    # can be turned off, so scaling out doesn't hit the catalog from every worker
+    RUN_MIGRATIONS_ON_STARTUP: bool = Field(default=True)
     
     # Apple specific
     APPLE_BUNDLE_ID: str = Field(...)
@@ -43,7 +78,8 @@ class Settings(BaseSettings):
     # Logging
     LOG_LEVEL: str = Field(default="INFO")
     
-    @validator("LOG_LEVEL")
+    @field_validator("LOG_LEVEL")
+    @classmethod
     def validate_log_level(cls, v):
         """Validate log level."""
         allowed_levels = ["DEBUG", "INFO", "WARNING", "ERROR", "CRITICAL"]
@@ -51,15 +87,29 @@ class Settings(BaseSettings):
             return "INFO"
         return v.upper()
     
-    class Config:
-        """Pydantic config."""
-        env_file = ".env"
-        case_sensitive = True
-        env_file_encoding = "utf-8"
+    model_config = SettingsConfigDict(
+        env_file=".env",
+        case_sensitive=True,
+        env_file_encoding="utf-8",
+    )
+
+
+@lru_cache(maxsize=1)
+def get_settings() -> Settings:
+    """
+    Get the application settings.
+    
+    Settings are read from the environment once and cached, so this can be
+    used freely as a FastAPI dependency.
+    
+    Returns:
+        Settings: The application settings
+    """
+    return Settings()  # type: ignore
 
 
 # Initialize settings
-settings = Settings()  # type: ignore
+settings = get_settings()
 
 # Configure logging
 logging.basicConfig(
@@ -2,29 +2,137 @@
 Security utilities module.
 Provides utilities for password hashing, token creation, and authentication.
 """
+import hashlib
 import logging
+import time
 from datetime import datetime, timedelta
-from typing import Optional, Dict, Any
+from functools import lru_cache
+from types import MappingProxyType
+from typing import Optional, Dict, Any, Tuple
 
+from cachetools import TTLCache
+
+import jwt as pyjwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
-from jose import JWTError, jwt
+from jose import JWTError, jwk, jwt
 from passlib.context import CryptContext
-from sqlalchemy.orm import Session
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.core.config import settings
-from app.db.session import get_db
+from app.db.session import get_async_db
 from app.models.user import User
 from app.schemas.token import TokenData
 
 logger = logging.getLogger(__name__)
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Longest password accepted, so huge inputs can't force expensive hashing
+MAX_PASSWORD_BYTES = 1024
+
+# bcrypt ignores input bytes beyond this
+BCRYPT_MAX_BYTES = 72
+
+# Stored for accounts that must not log in with a password; no password matches it
+UNUSABLE_PASSWORD_HASH = "!"
+
+
+@lru_cache(maxsize=1)
+def _pwd_context() -> CryptContext:
+    """
+    Get the password hashing context, building it on first use.
+    
+    Argon2id is used for new hashes; bcrypt is still verified so existing
+    hashes keep working until they are upgraded at login.
+    
+    Returns:
+        CryptContext: The password hashing context
+    """
+    return CryptContext(
+        schemes=["argon2", "bcrypt"],
+        default="argon2",
+        deprecated="auto",
+        argon2__memory_cost=settings.ARGON2_MEMORY_COST,
+        argon2__time_cost=settings.ARGON2_TIME_COST,
+        argon2__parallelism=settings.ARGON2_PARALLELISM,
+    )
+
 
-# OAuth2 scheme for token authentication
+# OAuth2 scheme for token authentication; cheap to build, and routes need it at
+# import time for their dependencies and the OpenAPI schema
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl=f"{settings.API_V1_PREFIX}/subscriptions/auth")
 
+# Token settings read on every authenticated request
+SECRET_KEY = settings.SECRET_KEY
+ALGORITHM = settings.ALGORITHM
+
+# Signing key and decode arguments built once instead of on every call
+_JWT_KEY = jwk.construct(SECRET_KEY, algorithm=ALGORITHM)
+_JWT_ALGORITHMS = [ALGORITHM]
+_JWT_OPTIONS = MappingProxyType({"verify_aud": False})
+
+# JWT implementation used for access tokens
+USE_PYJWT = settings.USE_PYJWT
+ACCESS_TOKEN_EXPIRE_MINUTES = settings.ACCESS_TOKEN_EXPIRE_MINUTES
+
+# Authenticated users by token digest, so repeat requests skip the JWT decode
+# and user query. Entries live for TOKEN_CACHE_TTL seconds at most, and never
+# past the token's own expiry.
+TOKEN_CACHE_TTL = 60
+_token_cache: TTLCache = TTLCache(maxsize=10_000, ttl=TOKEN_CACHE_TTL)
+
+# Users by ID, so new tokens for a recently seen user skip the user query too
+USER_CACHE_TTL = 30
+_user_cache: TTLCache = TTLCache(maxsize=10_000, ttl=USER_CACHE_TTL)
+
+
+def _token_key(token: str) -> bytes:
+    """
+    Get the cache key for a token.
+    
+    Args:
+        token: The JWT token
+        
+    Returns:
+        bytes: A digest of the token
+    """
+    return hashlib.blake2b(token.encode(), digest_size=16).digest()
+
+
+def invalidate_user(user_id: Any) -> None:
+    """
+    Drop a user from the authentication caches, e.g. after changing their
+    password or deactivating them.
+    
+    Args:
+        user_id: The user's ID
+    """
+    user_id = str(user_id)
+    _user_cache.pop(user_id, None)
+    for key, (user, _) in list(_token_cache.items()):
+        if str(user.id) == user_id:
+            _token_cache.pop(key, None)
+
+
+def _prepare_password(password: str) -> str:
+    """
+    Normalize a password before hashing.
+    
+    bcrypt only uses the first 72 bytes of its input, so longer passwords
+    are pre-hashed with SHA-256 to keep every byte significant. This is
+    applied the same way when hashing and verifying.
+    
+    Args:
+        password: The plain-text password
+        
+    Returns:
+        str: The password to feed to the hashing context
+    """
+    encoded = password.encode()
+    if len(encoded) > BCRYPT_MAX_BYTES:
+        return hashlib.sha256(encoded).hexdigest()
+    return password
+
 
 def verify_password(plain_password: str, hashed_password: str) -> bool:
     """
@@ -37,7 +145,36 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     Returns:
         bool: True if the password matches the hash
     """
-    return pwd_context.verify(plain_password, hashed_password)
+    return verify_and_update_password(plain_password, hashed_password)[0]
+
+
+def verify_and_update_password(plain_password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+    """
+    Verify a password against a hash, rehashing it if the hash is outdated.
+    
+    Passwords longer than MAX_PASSWORD_BYTES, and any password checked
+    against UNUSABLE_PASSWORD_HASH, are rejected without hashing.
+    
+    Args:
+        plain_password: The plain-text password
+        hashed_password: The hashed password
+        
+    Returns:
+        Tuple[bool, Optional[str]]: Whether the password matches, and a new hash
+        to store if the old one uses a deprecated scheme or cost settings
+    """
+    if hashed_password == UNUSABLE_PASSWORD_HASH or len(plain_password.encode()) > MAX_PASSWORD_BYTES:
+        return False, None
+    
+    prepared = _prepare_password(plain_password)
+    verified, new_hash = _pwd_context().verify_and_update(prepared, hashed_password)
+    
+    if not verified and prepared != plain_password:
+        # Long passwords hashed before pre-hashing was introduced
+        if _pwd_context().verify(plain_password, hashed_password):
+            return True, _pwd_context().hash(prepared)
+    
+    return verified, new_hash
 
 
 def get_password_hash(password: str) -> str:
@@ -49,8 +186,47 @@ def get_password_hash(password: str) -> str:
         
     Returns:
         str: The hashed password
+        
+    Raises:
+        ValueError: If the password is longer than MAX_PASSWORD_BYTES
     """
-    return pwd_context.hash(password)
+    if len(password.encode()) > MAX_PASSWORD_BYTES:
+        raise ValueError(f"Password must be at most {MAX_PASSWORD_BYTES} bytes")
+    return _pwd_context().hash(_prepare_password(password))
+
+
+def _encode_token(claims: Dict[str, Any]) -> str:
+    """
+    Encode and sign JWT claims with the configured JWT implementation.
+    
+    Args:
+        claims: The claims to encode
+        
+    Returns:
+        str: The encoded JWT token
+    """
+    if USE_PYJWT:
+        return pyjwt.encode(claims, SECRET_KEY, algorithm=ALGORITHM)
+    return jwt.encode(claims, _JWT_KEY, algorithm=ALGORITHM)
+
+
+def _decode_token(token: str) -> Dict[str, Any]:
+    """
+    Verify and decode a JWT token with the configured JWT implementation.
+    
+    Args:
+        token: The JWT token
+        
+    Returns:
+        Dict[str, Any]: The token's claims
+        
+    Raises:
+        JWTError: If python-jose rejects the token
+        pyjwt.InvalidTokenError: If PyJWT rejects the token
+    """
+    if USE_PYJWT:
+        return pyjwt.decode(token, SECRET_KEY, algorithms=_JWT_ALGORITHMS, options=_JWT_OPTIONS)
+    return jwt.decode(token, _JWT_KEY, algorithms=_JWT_ALGORITHMS, options=_JWT_OPTIONS)
 
 
 def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta] = None) -> str:
@@ -69,29 +245,28 @@ def create_access_token(data: Dict[str, Any], expires_delta: Optional[timedelta]
     if expires_delta:
         expire = datetime.utcnow() + expires_delta
     else:
-        expire = datetime.utcnow() + timedelta(minutes=settings.ACCESS_TOKEN_EXPIRE_MINUTES)
+        expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         
     to_encode.update({"exp": expire})
     
-    encoded_jwt = jwt.encode(
-        to_encode, 
-        settings.SECRET_KEY, 
-        algorithm=settings.ALGORITHM
-    )
-    
-    return encoded_jwt
+    return _encode_token(to_encode)
 
 
-def get_current_user(
+async def get_current_user(
     token: str = Depends(oauth2_scheme),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ) -> User:
     """
     Get the current authenticated user.
     
+    Users are cached by token for up to TOKEN_CACHE_TTL seconds and by ID
+    for up to USER_CACHE_TTL seconds, so changes to a user (e.g.
+    deactivation) can take that long to apply unless invalidate_user is
+    called.
+    
     Args:
         token: The JWT token
-        db: Database session
+        db: Async database session
         
     Returns:
         User: The authenticated user
@@ -105,13 +280,18 @@ def get_current_user(
         headers={"WWW-Authenticate": "Bearer"},
     )
     
+    cache_key = _token_key(token)
+    cached: Optional[Tuple[User, float]] = _token_cache.get(cache_key)
+    if cached is not None:
+        user, expires_at = cached
+        if expires_at > time.time():
+            # Attach the cached user to this request's session without a query
+            return await db.merge(user, load=False)
+        _token_cache.pop(cache_key, None)
+    
     try:
         # Decode the JWT token
-        payload = jwt.decode(
-            token, 
-            settings.SECRET_KEY, 
-            algorithms=[settings.ALGORITHM]
-        )
+        payload = _decode_token(token)
         user_id: str = payload.get("sub")
         
         if user_id is None:
@@ -119,15 +299,25 @@ def get_current_user(
             raise credentials_exception
             
         token_data = TokenData(user_id=user_id)
-    except JWTError as e:
-        logger.warning(f"JWT error: {str(e)}")
+    except (JWTError, pyjwt.InvalidTokenError) as e:
+        logger.warning("JWT error: %s", e)
+        _token_cache.pop(cache_key, None)
         raise credentials_exception
         
-    # Get the user from the database
-    user = db.query(User).filter(User.id == token_data.user_id).first()
-    
-    if user is None:
-        logger.warning(f"User not found: {token_data.user_id}")
-        raise credentials_exception
+    # Get the user, from the database unless it was recently loaded
+    user = _user_cache.get(token_data.user_id)
+    if user is not None:
+        user = await db.merge(user, load=False)
+    else:
+        user = (await db.execute(
+            select(User).where(User.id == token_data.user_id)
+        )).scalar_one_or_none()
         
+        if user is None:
+            logger.warning("User not found: %s", token_data.user_id)
+            raise credentials_exception
+        _user_cache[token_data.user_id] = user
+    
+    # Tokens without an exp are bounded by the cache TTL alone
+    _token_cache[cache_key] = (user, payload.get("exp", float("inf")))
     return user
@@ -1,30 +1,113 @@
 """
 Custom database types.
 """
+import threading
 import uuid
-from sqlalchemy import TypeDecorator, TEXT
+from functools import lru_cache
+from typing import Optional
+
+import orjson
+import zstandard as zstd
+from sqlalchemy import TypeDecorator, LargeBinary
+from sqlalchemy.dialects import postgresql
+
+from app.core.config import settings
+
+# Compression level for CompressedJSON columns
+ZSTD_LEVEL = 3
+
+# zstd (de)compressors aren't thread-safe, so each thread gets its own
+_zstd_local = threading.local()
 
 
 class SQLiteUUID(TypeDecorator):
     """
     Platform-independent UUID type.
-    Uses TEXT for SQLite, UUID for PostgreSQL.
+    Uses native UUID for PostgreSQL, 16-byte binary elsewhere (e.g. SQLite).
+    """
+    impl = LargeBinary(16)
+    cache_ok = True
+
+    def load_dialect_impl(self, dialect):
+        """Use PostgreSQL's native UUID type where available."""
+        if dialect.name == "postgresql":
+            return dialect.type_descriptor(postgresql.UUID(as_uuid=True))
+        return dialect.type_descriptor(LargeBinary(16))
+
+    def process_bind_param(self, value, dialect):
+        """Convert UUID to its native or 16-byte form when saving to database."""
+        if value is None:
+            return value
+        if not isinstance(value, uuid.UUID):
+            value = uuid.UUID(value)
+        if dialect.name == "postgresql":
+            return value
+        return value.bytes
+
+    def process_result_value(self, value, dialect):
+        """Convert stored value to UUID when retrieving from database."""
+        if value is None or isinstance(value, uuid.UUID):
+            return value
+        if dialect.name == "postgresql":
+            return uuid.UUID(str(value))
+        return uuid.UUID(bytes=value)
+
+
+@lru_cache(maxsize=1)
+def _zstd_dict() -> Optional[zstd.ZstdCompressionDict]:
+    """
+    Load the zstd dictionary configured in RAW_DATA_ZSTD_DICT_PATH, if any.
+    
+    A dictionary trained on sample notifications (zstd.train_dictionary)
+    compresses small, repetitive payloads much better. Rows written with a
+    dictionary can only be read back with the same dictionary.
+    
+    Returns:
+        Optional[zstd.ZstdCompressionDict]: The dictionary, or None if not configured
+    """
+    if not settings.RAW_DATA_ZSTD_DICT_PATH:
+        return None
+    with open(settings.RAW_DATA_ZSTD_DICT_PATH, "rb") as dict_file:
+        return zstd.ZstdCompressionDict(dict_file.read())
+
+
+def _zstd_compressor() -> zstd.ZstdCompressor:
+    """Get this thread's zstd compressor."""
+    compressor = getattr(_zstd_local, "compressor", None)
+    if compressor is None:
+        compressor = zstd.ZstdCompressor(level=ZSTD_LEVEL, dict_data=_zstd_dict())
+        _zstd_local.compressor = compressor
+    return compressor
+
+
+def _zstd_decompressor() -> zstd.ZstdDecompressor:
+    """Get this thread's zstd decompressor."""
+    decompressor = getattr(_zstd_local, "decompressor", None)
+    if decompressor is None:
+        decompressor = zstd.ZstdDecompressor(dict_data=_zstd_dict())
+        _zstd_local.decompressor = decompressor
+    return decompressor
+
+
+class CompressedJSON(TypeDecorator):
+    """
+    JSON stored as zstd-compressed binary.
+    Serializes with orjson, so datetimes and UUIDs in the data are supported.
     """
-    impl = TEXT
+    impl = LargeBinary
     cache_ok = True
 
     def process_bind_param(self, value, dialect):
-        """Convert UUID to string when saving to database."""
+        """Serialize and compress value when saving to database."""
         if value is None:
             return value
-        if isinstance(value, uuid.UUID):
-            return str(value)
-        return value
+        return _zstd_compressor().compress(orjson.dumps(value))
 
     def process_result_value(self, value, dialect):
-        """Convert string to UUID when retrieving from database."""
+        """Decompress and parse stored value when retrieving from database."""
         if value is None:
             return value
-        if not isinstance(value, uuid.UUID):
-            return uuid.UUID(value)
-        return value
+        if isinstance(value, str):
+            # Uncompressed JSON left over from before the column was compressed
+            return orjson.loads(value)
+        return orjson.loads(_zstd_decompressor().decompress(value))
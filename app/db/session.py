@@ -3,26 +3,151 @@ Database session module.
 Provides database session and connection management.
 """
 import logging
-from typing import Generator
+from typing import Any, AsyncGenerator, Dict, Generator, List, Type
+from uuid import uuid4
 
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, insert
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import sessionmaker, Session
+from sqlalchemy.sql.dml import Insert
 
 from app.core.config import settings
 
 logger = logging.getLogger(__name__)
 
+# Backend of the configured database, e.g. "postgresql" or "sqlite"
+DATABASE_BACKEND = make_url(settings.DATABASE_URL).get_backend_name()
+
+
+def get_pool_options() -> Dict[str, Any]:
+    """
+    Get the connection pool settings for an engine.
+    
+    SQLite doesn't use a sized pool (in-memory databases share a single
+    connection), so it keeps SQLAlchemy's defaults.
+    
+    Returns:
+        Dict[str, Any]: Keyword arguments for create_engine
+    """
+    if DATABASE_BACKEND == "sqlite":
+        return {}
+    return {
+        "pool_size": settings.DB_POOL_SIZE,
+        "max_overflow": settings.DB_MAX_OVERFLOW,
+        "pool_timeout": settings.DB_POOL_TIMEOUT,
+        "pool_recycle": settings.DB_POOL_RECYCLE,
+    }
+
+
+def get_connect_args(async_driver: bool = False) -> Dict[str, Any]:
+    """
+    Get the driver connection arguments for an engine.
+    
+    On PostgreSQL, connections identify themselves with DB_APPLICATION_NAME
+    and, unless DB_JIT is set, disable JIT compilation, which only slows
+    down the short queries this service runs. asyncpg connections keep up
+    to DB_STATEMENT_CACHE_SIZE prepared statements, both in asyncpg's own
+    cache and in the one SQLAlchemy's asyncpg dialect keeps on top of it.
+    With a size of 0, statements are also given unique names, so that
+    behind PgBouncer in transaction pooling mode one connection never runs
+    into a statement another client prepared on the same server connection.
+    
+    Args:
+        async_driver: Whether the arguments are for asyncpg rather than psycopg2
+        
+    Returns:
+        Dict[str, Any]: The connect_args for create_engine
+    """
+    if DATABASE_BACKEND != "postgresql":
+        return {}
+    server_settings = {"application_name": settings.DB_APPLICATION_NAME}
+    if not settings.DB_JIT:
+        server_settings["jit"] = "off"
+    if async_driver:
+        connect_args = {
+            "server_settings": server_settings,
+            "statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE,
+        }
+        if settings.DB_STATEMENT_CACHE_SIZE == 0:
+            connect_args["prepared_statement_name_func"] = lambda: f"__asyncpg_{uuid4()}__"
+        return connect_args
+    return {
+        "application_name": server_settings.pop("application_name"),
+        "options": " ".join(f"-c {name}={value}" for name, value in server_settings.items()),
+    }
+
+
 # Create SQLAlchemy engine
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
     echo=settings.DEBUG,
+    connect_args=get_connect_args(),
+    **get_pool_options(),
 )
 
+def _enable_sqlite_foreign_keys(dbapi_connection: Any, connection_record: Any) -> None:
+    """
+    Enforce foreign keys on a new SQLite connection; SQLite ignores them by default.
+    
+    Args:
+        dbapi_connection: The new DBAPI connection
+        connection_record: The pool's record for the connection
+    """
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA foreign_keys=ON")
+    cursor.close()
+
+
+if DATABASE_BACKEND == "sqlite":
+    event.listen(engine, "connect", _enable_sqlite_foreign_keys)
+
 # Create session factory
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Async drivers used in place of the configured sync ones
+ASYNC_DRIVERS = {
+    "postgresql": "asyncpg",
+    "sqlite": "aiosqlite",
+}
+
+
+def get_async_database_url(database_url: str) -> str:
+    """
+    Get the async driver equivalent of a database URL.
+    
+    Args:
+        database_url: The configured (sync) database URL
+        
+    Returns:
+        str: The URL with its driver replaced by the async one for its backend
+    """
+    url = make_url(database_url)
+    driver = ASYNC_DRIVERS.get(url.get_backend_name())
+    if driver is None:
+        return database_url
+    return url.set(drivername=f"{url.get_backend_name()}+{driver}").render_as_string(hide_password=False)
+
+
+# Create async SQLAlchemy engine for async endpoints
+async_engine = create_async_engine(
+    get_async_database_url(settings.DATABASE_URL),
+    pool_pre_ping=True,
+    echo=settings.DEBUG,
+    connect_args=get_connect_args(async_driver=True),
+    **get_pool_options(),
+)
+
+if DATABASE_BACKEND == "sqlite":
+    event.listen(async_engine.sync_engine, "connect", _enable_sqlite_foreign_keys)
+
+# Create async session factory
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
 # Create base class for models
 Base = declarative_base()
 
@@ -41,15 +166,83 @@ def get_db() -> Generator[Session, None, None]:
         db.close()
 
 
+async def get_async_db() -> AsyncGenerator[AsyncSession, None]:
+    """
+    Get async database session.
+    
+    Yields:
+        AsyncSession: An async SQLAlchemy session
+    """
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def dialect_insert(dialect_name: str, model: Type) -> Insert:
+    """
+    Build an INSERT for a model using the dialect's own insert construct.
+    
+    PostgreSQL and SQLite inserts support ON CONFLICT clauses; other
+    databases get a plain INSERT.
+    
+    Args:
+        dialect_name: The name of the session's SQL dialect
+        model: The mapped class to insert into
+        
+    Returns:
+        Insert: The insert statement
+    """
+    if dialect_name == "postgresql":
+        return postgresql.insert(model)
+    if dialect_name == "sqlite":
+        return sqlite.insert(model)
+    return insert(model)
+
+
+def insert_ignoring_conflicts(dialect_name: str, model: Type, index_elements: List[str]) -> Insert:
+    """
+    Build an INSERT that skips rows conflicting on a unique key.
+    
+    Uses ON CONFLICT DO NOTHING on PostgreSQL and SQLite; other databases
+    get a plain INSERT, so conflicts raise IntegrityError there.
+    
+    Args:
+        dialect_name: The name of the session's SQL dialect
+        model: The mapped class to insert into
+        index_elements: The unique columns to check for conflicts
+        
+    Returns:
+        Insert: The insert statement, ready for values() and returning()
+    """
+    stmt = dialect_insert(dialect_name, model)
+    if dialect_name in ("postgresql", "sqlite"):
+        stmt = stmt.on_conflict_do_nothing(index_elements=index_elements)
+    return stmt
+
+
 def create_tables() -> None:
     """
     Create database tables defined in models.
-    Should be called once on application startup.
+    Used by the deployment scripts; the app itself uses create_tables_async.
     """
     try:
         logger.info("Creating database tables...")
         Base.metadata.create_all(bind=engine)
         logger.info("Database tables created successfully")
     except Exception as e:
-        logger.error(f"Error creating database tables: {str(e)}")
+        logger.error("Error creating database tables: %s", e)
+        raise
+
+
+async def create_tables_async() -> None:
+    """
+    Create database tables defined in models using the async engine.
+    Runs the DDL without blocking the event loop, for use at startup.
+    """
+    try:
+        logger.info("Creating database tables...")
+        async with async_engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        logger.info("Database tables created successfully")
+    except Exception as e:
+        logger.error("Error creating database tables: %s", e)
         raise
@@ -3,9 +3,9 @@ Subscription models module.
 Defines models related to Apple App Store subscriptions.
 """
 import enum
-from sqlalchemy import Column, String, ForeignKey, Enum, DateTime, JSON, Boolean, Text
+from sqlalchemy import Column, String, ForeignKey, Enum, DateTime, Boolean, Text, Index
 
-from app.db.custom_types import SQLiteUUID
+from app.db.custom_types import CompressedJSON, SQLiteUUID
 from sqlalchemy.orm import relationship
 from datetime import datetime
 
@@ -44,26 +44,52 @@ class NotificationType(str, enum.Enum):
     TEST = "TEST"
 
 
+def _string_enum(enum_class: type) -> Enum:
+    """
+    Build a column type storing an enum as its value in a VARCHAR(32).
+    
+    Avoids native ENUM types on PostgreSQL, so new members need no
+    ALTER TYPE and all databases store the same strings.
+    
+    Args:
+        enum_class: The enum class to store
+        
+    Returns:
+        Enum: The column type
+    """
+    return Enum(
+        enum_class,
+        native_enum=False,
+        length=32,
+        values_callable=lambda members: [member.value for member in members],
+    )
+
+
 class Subscription(BaseModel):
     """
     Subscription model for storing subscription information.
     """
     __tablename__ = "subscriptions"
+    __table_args__ = (
+        # User-scoped lookups, optionally filtered by status
+        Index("ix_subs_user_status", "user_id", "status"),
+    )
     
     user_id = Column(SQLiteUUID, ForeignKey("users.id"), nullable=False)
     original_transaction_id = Column(String, unique=True, index=True, nullable=False)
     product_id = Column(String, nullable=False)
-    status = Column(Enum(SubscriptionStatus), nullable=False)
+    status = Column(_string_enum(SubscriptionStatus), nullable=False)
     expires_date = Column(DateTime)
     purchase_date = Column(DateTime, nullable=False)
     auto_renew_status = Column(Boolean, default=False)
     environment = Column(String, default="Production")
     
-    # Store raw JSON data for flexibility
-    raw_data = Column(JSON)
+    # Store raw JSON data for flexibility, compressed
+    raw_data = Column(CompressedJSON)
     
-    # Relationships
-    user = relationship("User", back_populates="subscriptions")
+    # Relationships; the many-to-one sides raise instead of lazy loading, so
+    # N+1 access shows up as an error rather than extra queries
+    user = relationship("User", back_populates="subscriptions", lazy="raise")
     notifications = relationship("NotificationHistory", back_populates="subscription", cascade="all, delete-orphan")
     
     def __repr__(self):
@@ -75,20 +101,23 @@ class NotificationHistory(BaseModel):
     Model for storing notification history from Apple.
     """
     __tablename__ = "notification_history"
+    __table_args__ = (
+        Index("ix_nh_sub_type", "subscription_id", "notification_type"),
+    )
     
     subscription_id = Column(SQLiteUUID, ForeignKey("subscriptions.id"), nullable=False)
-    notification_type = Column(Enum(NotificationType), nullable=False)
+    notification_type = Column(_string_enum(NotificationType), nullable=False)
     subtype = Column(String)
     notification_uuid = Column(String, unique=True, index=True, nullable=False)
     signed_payload = Column(Text, nullable=False)
     processed = Column(Boolean, default=False)
     processing_error = Column(Text)
     
-    # Store raw JSON data for flexibility
-    raw_data = Column(JSON)
+    # Store raw JSON data for flexibility, compressed
+    raw_data = Column(CompressedJSON)
     
     # Relationships
-    subscription = relationship("Subscription", back_populates="notifications")
+    subscription = relationship("Subscription", back_populates="notifications", lazy="raise")
     
     def __repr__(self):
         return f"<NotificationHistory {self.notification_uuid}>"
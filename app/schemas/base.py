@@ -3,16 +3,14 @@ Base schema module.
 """
 from datetime import datetime
 from typing import Optional
-from pydantic import BaseModel, Field
+from pydantic import BaseModel, ConfigDict, Field
 import uuid
 
 
 class BaseSchema(BaseModel):
     """Base schema with common fields."""
+    model_config = ConfigDict(from_attributes=True)
+
     id: uuid.UUID = Field(...)
     created_at: datetime
     updated_at: datetime
-
-    class Config:
-        """Pydantic config."""
-        orm_mode = True
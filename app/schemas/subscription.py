@@ -38,6 +38,7 @@ class Subscription(BaseSchema, SubscriptionBase):
     """Schema for subscription response."""
     user_id: uuid.UUID
     original_transaction_id: str
+    # Only loaded when requested; None otherwise
     raw_data: Optional[Dict[str, Any]] = None
 
 
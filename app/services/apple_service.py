@@ -0,0 +1,72 @@
+"""
+Apple API service module.
+
+Provides authentication for requests to Apple's App Store Server API.
+"""
+import logging
+import time
+from typing import Optional
+
+import jwt
+
+from app.core.apple_keys import get_apple_private_key
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+# Audience Apple expects in App Store Server API tokens
+APPLE_API_AUDIENCE = "appstoreconnect-v1"
+
+# Apple accepts tokens valid for at most an hour
+TOKEN_LIFETIME = 20 * 60
+
+# Tokens are replaced this long before they expire
+TOKEN_REFRESH_MARGIN = 5 * 60
+
+
+class AppleService:
+    """
+    Service for authenticating with Apple's App Store Server API.
+    """
+
+    # Signed token and its expiry, shared by all instances
+    _token: Optional[str] = None
+    _token_expires_at: float = 0.0
+
+    def generate_token(self) -> str:
+        """
+        Get a signed ES256 token for the App Store Server API.
+
+        The token is signed with the configured private key and reused
+        until TOKEN_REFRESH_MARGIN seconds before it expires.
+
+        Returns:
+            str: The signed JWT
+
+        Raises:
+            ValueError: If the private key is not configured or invalid
+            OSError: If the private key file cannot be read
+        """
+        now = time.time()
+        cls = type(self)
+        if cls._token is not None and now < cls._token_expires_at - TOKEN_REFRESH_MARGIN:
+            return cls._token
+
+        issued_at = int(now)
+        expires_at = issued_at + TOKEN_LIFETIME
+        token = jwt.encode(
+            {
+                "iss": settings.APPLE_ISSUER_ID,
+                "iat": issued_at,
+                "exp": expires_at,
+                "aud": APPLE_API_AUDIENCE,
+                "bid": settings.APPLE_BUNDLE_ID,
+            },
+            get_apple_private_key(),
+            algorithm="ES256",
+            headers={"kid": settings.APPLE_PRIVATE_KEY_ID},
+        )
+
+        cls._token, cls._token_expires_at = token, expires_at
+        logger.info("Generated App Store Server API token, valid until %s", expires_at)
+        return token
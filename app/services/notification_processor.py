@@ -5,36 +5,107 @@ Processes Apple App Store Server Notifications and updates subscription data.
 """
 import logging
 import uuid
-import json
-import base64
-from typing import Dict, Any, Optional
-from datetime import datetime
-from sqlalchemy.orm import Session
+from dataclasses import dataclass
+from typing import Dict, Any, Callable, Optional
+from datetime import datetime, timedelta
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.core.apple_jws import AppleJWSVerifier
+from app.core.apple_jws import JWSVerificationError, verify_jws
+from app.core.security import UNUSABLE_PASSWORD_HASH
 from app.models.subscription import (
     Subscription,
     NotificationHistory,
     SubscriptionStatus as SubscriptionStatusEnum,
     NotificationType
 )
+from app.db.session import insert_ignoring_conflicts
 from app.models.user import User
-from app.services.subscription_service import SubscriptionService
+from app.services.subscription_service import SubscriptionService, invalidate_subscription_status
 
 logger = logging.getLogger(__name__)
 
+# Apple timestamps are milliseconds since this epoch. Kept naive (UTC) to
+# match the DateTime columns and the utcnow() defaults used elsewhere.
+_EPOCH = datetime(1970, 1, 1)
+
+
+def _ms_to_datetime(ms: int) -> datetime:
+    """
+    Convert an Apple millisecond timestamp to a naive UTC datetime.
+    
+    Args:
+        ms: Milliseconds since the Unix epoch
+        
+    Returns:
+        datetime: The timestamp as a naive UTC datetime
+    """
+    return _EPOCH + timedelta(milliseconds=ms)
+
+
+@dataclass(slots=True)
+class TxInfo:
+    """
+    Transaction fields of a notification, extracted once per notification.
+    """
+    original_transaction_id: Optional[str]
+    product_id: str
+    purchase_date_ms: Optional[int]
+    expires_date_ms: Optional[int]
+    auto_renew_status: bool
+    environment: str
+    # The decoded transaction (or renewal) info the fields came from
+    raw: Dict[str, Any]
+
+
+def _did_renew_rule(payload: Dict[str, Any], tx_info: TxInfo) -> Dict[str, Any]:
+    """Renewed: active again, with the new expiration date if given."""
+    data: Dict[str, Any] = {"status": SubscriptionStatusEnum.ACTIVE}
+    if tx_info.expires_date_ms:
+        data["expires_date"] = _ms_to_datetime(tx_info.expires_date_ms)
+    return data
+
+
+def _did_fail_to_renew_rule(payload: Dict[str, Any], tx_info: TxInfo) -> Dict[str, Any]:
+    """Auto-renew failed: grace period if Apple granted one, else billing retry."""
+    if payload.get("subtype") == "GRACE_PERIOD":
+        return {"status": SubscriptionStatusEnum.IN_GRACE_PERIOD}
+    return {"status": SubscriptionStatusEnum.IN_BILLING_RETRY}
+
+
+def _status_rule(status: SubscriptionStatusEnum) -> Callable[[Dict[str, Any], TxInfo], Dict[str, Any]]:
+    """Build a rule that only sets the given status."""
+    return lambda payload, tx_info: {"status": status}
+
+
+# Notification types by their string value, for lookups without the enum's
+# value scan and ValueError on unknown types
+_NOTIFICATION_TYPES: Dict[str, NotificationType] = {m.value: m for m in NotificationType}
+
+# Subscription changes for each notification type; types not listed here
+# only update the auto-renew status
+_STATUS_RULES: Dict[NotificationType, Callable[[Dict[str, Any], TxInfo], Dict[str, Any]]] = {
+    NotificationType.SUBSCRIBED: _status_rule(SubscriptionStatusEnum.ACTIVE),
+    NotificationType.DID_RENEW: _did_renew_rule,
+    NotificationType.DID_FAIL_TO_RENEW: _did_fail_to_renew_rule,
+    NotificationType.EXPIRED: _status_rule(SubscriptionStatusEnum.EXPIRED),
+    NotificationType.GRACE_PERIOD_EXPIRED: _status_rule(SubscriptionStatusEnum.EXPIRED),
+    NotificationType.REFUND: _status_rule(SubscriptionStatusEnum.REFUNDED),
+    NotificationType.REVOKE: _status_rule(SubscriptionStatusEnum.REVOKED),
+}
+
 
 class NotificationProcessor:
     """
     Service for processing Apple App Store Server Notifications.
     """
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         """
         Initialize the notification processor.
         
         Args:
-            db: Database session
+            db: Async database session
         """
         self.db = db
         self.subscription_service = SubscriptionService(db)
@@ -63,25 +134,28 @@ class NotificationProcessor:
             if not notification_uuid:
                 logger.error("Missing notificationUUID in payload")
                 return
-                
-            # Check for duplicate notifications
-            existing_notification = self.db.query(NotificationHistory).filter(
-                NotificationHistory.notification_uuid == notification_uuid
-            ).first()
             
-            if existing_notification:
-                logger.info(f"Duplicate notification received: {notification_uuid}")
+            # Skip redeliveries before any verification or subscription work;
+            # the conflict check on insert below still catches concurrent ones
+            if await self._is_duplicate(notification_uuid):
+                logger.info("Duplicate notification received: %s", notification_uuid)
                 return
                 
+            # Extract transaction info once for all the steps below
+            tx_info = await self._extract_tx_info(decoded_payload)
+            
             # Get or create subscription
-            subscription = await self._get_or_create_subscription(decoded_payload)
+            subscription = await self._get_or_create_subscription(tx_info)
             
             if not subscription:
                 logger.error("Failed to get or create subscription for notification")
                 return
                 
-            # Record notification history
-            notification = NotificationHistory(
+            # Record notification history; a conflicting notificationUUID means
+            # a concurrent delivery of this notification was processed first
+            stmt = insert_ignoring_conflicts(
+                self.db.get_bind().dialect.name, NotificationHistory, ["notification_uuid"]
+            ).values(
                 subscription_id=subscription.id,
                 notification_type=notification_type,
                 subtype=subtype,
@@ -89,43 +163,57 @@ class NotificationProcessor:
                 signed_payload=signed_payload,
                 raw_data=decoded_payload,
                 processed=True
-            )
+            ).returning(NotificationHistory.id)
             
-            self.db.add(notification)
+            if (await self.db.execute(stmt)).scalar_one_or_none() is None:
+                await self.db.rollback()
+                logger.info("Duplicate notification received: %s", notification_uuid)
+                return
             
             # Update subscription based on notification type
-            await self._update_subscription_status(subscription, notification_type, decoded_payload)
+            await self._update_subscription_status(subscription, notification_type, decoded_payload, tx_info)
             
-            # Commit changes
-            self.db.commit()
-            logger.info(f"Processed {notification_type} notification: {notification_uuid}")
+            # Commit changes; drop the status again in case it was re-cached
+            # from the old rows before the commit
+            await self.db.commit()
+            invalidate_subscription_status(subscription.user_id)
+            logger.info("Processed %s notification: %s", notification_type, notification_uuid)
             
         except Exception as e:
-            self.db.rollback()
-            logger.error(f"Error processing notification: {str(e)}")
+            await self.db.rollback()
+            logger.error("Error processing notification: %s", e)
+    
+    async def _is_duplicate(self, notification_uuid: str) -> bool:
+        """
+        Check whether a notification has already been recorded.
+        
+        Args:
+            notification_uuid: The notification's UUID
+            
+        Returns:
+            bool: True if a history row with this UUID exists
+        """
+        return (await self.db.scalar(
+            select(NotificationHistory.id)
+            .where(NotificationHistory.notification_uuid == notification_uuid)
+            .limit(1)
+        )) is not None
     
     async def _get_or_create_subscription(
         self,
-        payload: Dict[str, Any]
+        tx_info: TxInfo
     ) -> Optional[Subscription]:
         """
-        Get or create a subscription from notification payload.
+        Get or create a subscription from notification transaction info.
         
         Args:
-            payload: The notification payload
+            tx_info: The notification's transaction info
             
         Returns:
             Optional[Subscription]: The subscription, or None if it couldn't be created
         """
         try:
-            # Extract transaction data
-            transaction_info = self._extract_transaction_info(payload)
-            
-            if not transaction_info:
-                logger.error("No transaction info found in notification payload")
-                return None
-                
-            original_transaction_id = transaction_info.get("originalTransactionId")
+            original_transaction_id = tx_info.original_transaction_id
             
             if not original_transaction_id:
                 logger.error("No originalTransactionId found in transaction info")
@@ -145,56 +233,54 @@ class NotificationProcessor:
             # For this example, we'll use a demo user or create one if needed
             
             # Try to find a demo user or create one
-            user = self.db.query(User).first()
+            user = (await self.db.execute(select(User).limit(1))).scalars().first()
             if not user:
                 # Create a demo user if none exists
-                # In a real app, you'd have proper user management
-                from app.core.security import get_password_hash
+                # In a real app, you'd have proper user management. The
+                # placeholder can't log in, so there's no password to hash.
                 user = User(
                     email="demo@example.com",
-                    hashed_password=get_password_hash("demopassword"),
+                    hashed_password=UNUSABLE_PASSWORD_HASH,
                     full_name="Demo User"
                 )
+                # The ID is generated client-side, so a flush is enough to use it;
+                # the user is committed along with the rest of the notification
                 self.db.add(user)
-                self.db.commit()
-                self.db.refresh(user)
+                await self.db.flush()
                 logger.info("Created demo user for subscription")
             
             # Create subscription data
-            product_id = transaction_info.get("productId", "unknown_product")
-            purchase_date_ms = transaction_info.get("purchaseDate")
-            expires_date_ms = transaction_info.get("expiresDate")
-            
-            purchase_date = datetime.utcfromtimestamp(purchase_date_ms / 1000) if purchase_date_ms else datetime.utcnow()
-            expires_date = datetime.utcfromtimestamp(expires_date_ms / 1000) if expires_date_ms else None
+            purchase_date_ms = tx_info.purchase_date_ms
+            expires_date_ms = tx_info.expires_date_ms
             
-            auto_renew_status = self._extract_auto_renew_status(payload)
-            environment = payload.get("environment", "Production")
+            purchase_date = _ms_to_datetime(purchase_date_ms) if purchase_date_ms else datetime.utcnow()
+            expires_date = _ms_to_datetime(expires_date_ms) if expires_date_ms else None
             
             subscription_data = {
                 "user_id": user.id,
                 "original_transaction_id": original_transaction_id,
-                "product_id": product_id,
+                "product_id": tx_info.product_id,
                 "status": SubscriptionStatusEnum.ACTIVE,  # Default to active, will be updated based on notification
                 "purchase_date": purchase_date,
                 "expires_date": expires_date,
-                "auto_renew_status": auto_renew_status,
-                "environment": environment,
-                "raw_data": transaction_info
+                "auto_renew_status": tx_info.auto_renew_status,
+                "environment": tx_info.environment,
+                "raw_data": tx_info.raw
             }
             
             # Create the subscription
             return await self.subscription_service.create_subscription(subscription_data)
             
         except Exception as e:
-            logger.error(f"Error getting or creating subscription: {str(e)}")
+            logger.error("Error getting or creating subscription: %s", e)
             return None
     
     async def _update_subscription_status(
         self,
         subscription: Subscription,
         notification_type: NotificationType,
-        payload: Dict[str, Any]
+        payload: Dict[str, Any],
+        tx_info: TxInfo
     ) -> None:
         """
         Update subscription status based on notification type.
@@ -203,47 +289,20 @@ class NotificationProcessor:
             subscription: The subscription to update
             notification_type: The notification type
             payload: The notification payload
+            tx_info: The notification's transaction info
             
         Returns:
             None
         """
-        subscription_data = {}
+        subscription_data: Dict[str, Any] = {}
         
         # Update status based on notification type
-        if notification_type == NotificationType.SUBSCRIBED:
-            subscription_data["status"] = SubscriptionStatusEnum.ACTIVE
-            
-        elif notification_type == NotificationType.DID_RENEW:
-            subscription_data["status"] = SubscriptionStatusEnum.ACTIVE
-            
-            # Update expiration date from payload
-            expires_date_ms = self._extract_expires_date(payload)
-            if expires_date_ms:
-                subscription_data["expires_date"] = datetime.utcfromtimestamp(expires_date_ms / 1000)
-            
-        elif notification_type == NotificationType.DID_FAIL_TO_RENEW:
-            # If auto-renew failed, but still in grace period
-            if payload.get("subtype") == "GRACE_PERIOD":
-                subscription_data["status"] = SubscriptionStatusEnum.IN_GRACE_PERIOD
-            else:
-                subscription_data["status"] = SubscriptionStatusEnum.IN_BILLING_RETRY
-            
-        elif notification_type == NotificationType.EXPIRED:
-            subscription_data["status"] = SubscriptionStatusEnum.EXPIRED
-            
-        elif notification_type == NotificationType.GRACE_PERIOD_EXPIRED:
-            subscription_data["status"] = SubscriptionStatusEnum.EXPIRED
-            
-        elif notification_type == NotificationType.REFUND:
-            subscription_data["status"] = SubscriptionStatusEnum.REFUNDED
-            
-        elif notification_type == NotificationType.REVOKE:
-            subscription_data["status"] = SubscriptionStatusEnum.REVOKED
+        rule = _STATUS_RULES.get(notification_type)
+        if rule:
+            subscription_data.update(rule(payload, tx_info))
             
         # Update auto-renew status from payload
-        auto_renew_status = self._extract_auto_renew_status(payload)
-        if auto_renew_status is not None:
-            subscription_data["auto_renew_status"] = auto_renew_status
+        subscription_data["auto_renew_status"] = tx_info.auto_renew_status
             
         # Update the subscription if we have changes
         if subscription_data:
@@ -263,14 +322,16 @@ class NotificationProcessor:
             NotificationType: The notification type
         """
         type_str = payload.get("notificationType")
+        if not type_str:
+            return NotificationType.TEST
         
-        try:
-            return NotificationType(type_str) if type_str else NotificationType.TEST
-        except ValueError:
-            logger.warning(f"Unknown notification type: {type_str}, defaulting to TEST")
+        notification_type = _NOTIFICATION_TYPES.get(type_str)
+        if notification_type is None:
+            logger.warning("Unknown notification type: %s, defaulting to TEST", type_str)
             return NotificationType.TEST
+        return notification_type
     
-    def _extract_transaction_info(self, payload: Dict[str, Any]) -> Dict[str, Any]:
+    async def _extract_transaction_info(self, payload: Dict[str, Any]) -> Dict[str, Any]:
         """
         Extract transaction info from payload.
         
@@ -285,72 +346,51 @@ class NotificationProcessor:
             # Check signedRenewalInfo
             if "signedRenewalInfo" in payload["data"]:
                 try:
-                    renewal_info = AppleJWSVerifier.verify_jws(payload["data"]["signedRenewalInfo"])
+                    renewal_info = await verify_jws(payload["data"]["signedRenewalInfo"])
                     if renewal_info and isinstance(renewal_info, dict):
                         return renewal_info
-                except Exception as e:
-                    logger.warning(f"Error decoding signedRenewalInfo: {str(e)}")
-                    # Try extracting the payload directly
-                    try:
-                        parts = payload["data"]["signedRenewalInfo"].split('.')
-                        if len(parts) == 3:  # Valid JWS format
-                            payload_segment = parts[1]
-                            # Add padding if necessary
-                            padded_payload = payload_segment + '=' * (4 - len(payload_segment) % 4)
-                            direct_renewal_info = json.loads(base64.b64decode(padded_payload).decode('utf-8'))
-                            logger.info("Successfully extracted renewal info by direct decoding")
-                            if direct_renewal_info and isinstance(direct_renewal_info, dict):
-                                return direct_renewal_info
-                    except Exception as e2:
-                        logger.warning(f"Failed to extract renewal info directly: {str(e2)}")
+                except JWSVerificationError as e:
+                    logger.warning("Error decoding signedRenewalInfo: %s", e)
+                    # Fall back to the payload the verifier decoded without checking it
+                    if e.payload:
+                        logger.info("Successfully extracted renewal info by direct decoding")
+                        return e.payload
+                    logger.warning("Failed to extract renewal info directly")
             
             # Check signedTransactionInfo
             if "signedTransactionInfo" in payload["data"]:
                 try:
-                    transaction_info = AppleJWSVerifier.verify_jws(payload["data"]["signedTransactionInfo"])
+                    transaction_info = await verify_jws(payload["data"]["signedTransactionInfo"])
                     if transaction_info and isinstance(transaction_info, dict):
                         return transaction_info
-                except Exception as e:
-                    logger.warning(f"Error decoding signedTransactionInfo: {str(e)}")
-                    # Try extracting the payload directly
-                    try:
-                        parts = payload["data"]["signedTransactionInfo"].split('.')
-                        if len(parts) == 3:  # Valid JWS format
-                            payload_segment = parts[1]
-                            # Add padding if necessary
-                            padded_payload = payload_segment + '=' * (4 - len(payload_segment) % 4)
-                            direct_transaction_info = json.loads(base64.b64decode(padded_payload).decode('utf-8'))
-                            logger.info("Successfully extracted transaction info by direct decoding")
-                            if direct_transaction_info and isinstance(direct_transaction_info, dict):
-                                return direct_transaction_info
-                    except Exception as e2:
-                        logger.warning(f"Failed to extract transaction info directly: {str(e2)}")
+                except JWSVerificationError as e:
+                    logger.warning("Error decoding signedTransactionInfo: %s", e)
+                    # Fall back to the payload the verifier decoded without checking it
+                    if e.payload:
+                        logger.info("Successfully extracted transaction info by direct decoding")
+                        return e.payload
+                    logger.warning("Failed to extract transaction info directly")
         
         # Fallback to the raw payload if we couldn't extract transaction info
         return payload
     
-    def _extract_expires_date(self, payload: Dict[str, Any]) -> Optional[int]:
-        """
-        Extract expires date from payload.
-        
-        Args:
-            payload: The notification payload
-            
-        Returns:
-            Optional[int]: The expires date in milliseconds since epoch
-        """
-        transaction_info = self._extract_transaction_info(payload)
-        return transaction_info.get("expiresDate")
-    
-    def _extract_auto_renew_status(self, payload: Dict[str, Any]) -> bool:
+    async def _extract_tx_info(self, payload: Dict[str, Any]) -> TxInfo:
         """
-        Extract auto renew status from payload.
+        Extract the transaction fields used in processing from payload.
         
         Args:
             payload: The notification payload
             
         Returns:
-            bool: The auto renew status
+            TxInfo: The transaction info
         """
-        transaction_info = self._extract_transaction_info(payload)
-        return bool(transaction_info.get("autoRenewStatus", False))
+        transaction_info = await self._extract_transaction_info(payload)
+        return TxInfo(
+            original_transaction_id=transaction_info.get("originalTransactionId"),
+            product_id=transaction_info.get("productId", "unknown_product"),
+            purchase_date_ms=transaction_info.get("purchaseDate"),
+            expires_date_ms=transaction_info.get("expiresDate"),
+            auto_renew_status=bool(transaction_info.get("autoRenewStatus", False)),
+            environment=payload.get("environment", "Production"),
+            raw=transaction_info
+        )
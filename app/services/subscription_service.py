@@ -7,8 +7,13 @@ import logging
 import uuid
 from typing import List, Dict, Any, Optional
 from datetime import datetime
-from sqlalchemy.orm import Session
+from cachetools import TTLCache
+from sqlalchemy import select, update
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import raiseload
 from fastapi import HTTPException, status
+from pydantic import TypeAdapter
 
 from app.models.subscription import Subscription as SubscriptionModel
 from app.models.subscription import SubscriptionStatus as SubscriptionStatusEnum
@@ -21,27 +26,86 @@ from app.schemas.subscription import (
 
 logger = logging.getLogger(__name__)
 
+# Subscription statuses by user ID, for clients polling their entitlements.
+# Entries are dropped whenever one of the user's subscriptions changes. The
+# cache is only touched from the event loop, never across an await, so it
+# needs no lock.
+STATUS_CACHE_TTL = 30
+_status_cache: TTLCache = TTLCache(maxsize=100_000, ttl=STATUS_CACHE_TTL)
+
+
+# Validator for converting rows to response schemas, built once
+_SUBSCRIPTION_LIST_ADAPTER = TypeAdapter(List[Subscription])
+
+# Subscription columns except the compressed raw payload; rows selected with
+# these validate with raw_data left as None
+_SUBSCRIPTION_LIST_COLUMNS = [
+    attr.class_attribute
+    for attr in SubscriptionModel.__mapper__.column_attrs
+    if attr.key != "raw_data"
+]
+
+# Columns update_subscription may change
+_UPDATABLE = frozenset({
+    "product_id",
+    "status",
+    "expires_date",
+    "purchase_date",
+    "auto_renew_status",
+    "environment",
+    "raw_data",
+})
+
+
+def invalidate_subscription_status(user_id: uuid.UUID) -> None:
+    """
+    Drop a user's cached subscription status.
+    
+    Args:
+        user_id: The user's ID
+    """
+    _status_cache.pop(user_id, None)
+
 
 class SubscriptionService:
     """
     Service for subscription-related operations.
     """
     
-    def __init__(self, db: Session):
+    def __init__(self, db: AsyncSession):
         """
         Initialize the subscription service.
         
         Args:
-            db: Database session
+            db: Async database session
         """
         self.db = db
     
-    async def get_user_subscription_status(self, user_id: uuid.UUID) -> SubscriptionStatus:
+    async def _user_exists(self, user_id: Any) -> bool:
+        """
+        Check whether a user exists, selecting only the primary key.
+        
+        Args:
+            user_id: The user ID to check
+        
+        Returns:
+            bool: True if the user exists
+        """
+        return await self.db.scalar(select(User.id).where(User.id == user_id)) is not None
+    
+    async def get_user_subscription_status(
+        self,
+        user_id: uuid.UUID,
+        include_raw_data: bool = False
+    ) -> SubscriptionStatus:
         """
         Get a user's subscription status.
         
+        Statuses without raw data are cached for up to STATUS_CACHE_TTL seconds.
+        
         Args:
             user_id: The user ID to check
+            include_raw_data: Also load each subscription's raw Apple payload
         
         Returns:
             SubscriptionStatus: The user's subscription status
@@ -49,33 +113,45 @@ class SubscriptionService:
         Raises:
             HTTPException: If user is not found
         """
+        if not include_raw_data:
+            cached = _status_cache.get(user_id)
+            if cached is not None:
+                return cached
+        
         # Check if the user exists
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
-            logger.warning(f"User not found: {user_id}")
+        if not await self._user_exists(user_id):
+            logger.warning("User not found: %s", user_id)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
             
-        # Get active subscriptions
-        active_subscriptions = await self.get_user_active_subscriptions(user_id)
+        # Get active subscriptions; the user is already known to exist
+        active_subscriptions = await self._get_active_subscriptions(user_id, include_raw_data)
         
         # Determine overall status
         has_active_subscription = len(active_subscriptions) > 0
         
-        return SubscriptionStatus(
+        subscription_status = SubscriptionStatus(
             user_id=user_id,
             has_active_subscription=has_active_subscription,
             subscriptions=active_subscriptions
         )
+        if not include_raw_data:
+            _status_cache[user_id] = subscription_status
+        return subscription_status
     
-    async def get_user_active_subscriptions(self, user_id: uuid.UUID) -> List[Subscription]:
+    async def get_user_active_subscriptions(
+        self,
+        user_id: uuid.UUID,
+        include_raw_data: bool = False
+    ) -> List[Subscription]:
         """
         Get a user's active subscriptions.
         
         Args:
             user_id: The user ID to check
+            include_raw_data: Also load each subscription's raw Apple payload
         
         Returns:
             List[Subscription]: The user's active subscriptions
@@ -84,22 +160,49 @@ class SubscriptionService:
             HTTPException: If user is not found
         """
         # Check if the user exists
-        user = self.db.query(User).filter(User.id == user_id).first()
-        if not user:
-            logger.warning(f"User not found: {user_id}")
+        if not await self._user_exists(user_id):
+            logger.warning("User not found: %s", user_id)
             raise HTTPException(
                 status_code=status.HTTP_404_NOT_FOUND,
                 detail="User not found"
             )
-            
-        # Query active subscriptions
-        active_subscriptions = self.db.query(SubscriptionModel).filter(
-            SubscriptionModel.user_id == user_id,
-            SubscriptionModel.status == SubscriptionStatusEnum.ACTIVE
-        ).all()
-        
-        # Convert to schema models
-        return [Subscription.from_orm(subscription) for subscription in active_subscriptions]
+        
+        return await self._get_active_subscriptions(user_id, include_raw_data)
+    
+    async def _get_active_subscriptions(
+        self,
+        user_id: uuid.UUID,
+        include_raw_data: bool = False
+    ) -> List[Subscription]:
+        """
+        Get a user's active subscriptions without checking the user exists.
+        
+        Without include_raw_data only the plain columns are selected, so the
+        compressed payload is neither fetched nor decompressed.
+        
+        Args:
+            user_id: The user ID to check
+            include_raw_data: Also load each subscription's raw Apple payload
+        
+        Returns:
+            List[Subscription]: The user's active subscriptions
+        """
+        if include_raw_data:
+            # The response schema doesn't include relationships, so none are loaded
+            query = select(SubscriptionModel).options(raiseload("*"))
+        else:
+            query = select(*_SUBSCRIPTION_LIST_COLUMNS)
+        
+        result = await self.db.execute(
+            query.where(
+                SubscriptionModel.user_id == user_id,
+                SubscriptionModel.status == SubscriptionStatusEnum.ACTIVE
+            )
+        )
+        active_subscriptions = result.scalars().all() if include_raw_data else result.all()
+        
+        # Convert to schema models in a single validation pass
+        return _SUBSCRIPTION_LIST_ADAPTER.validate_python(active_subscriptions, from_attributes=True)
     
     async def get_subscription_by_original_transaction_id(self, original_transaction_id: str) -> Optional[SubscriptionModel]:
         """
@@ -111,14 +214,18 @@ class SubscriptionService:
         Returns:
             Optional[SubscriptionModel]: The subscription if found, None otherwise
         """
-        return self.db.query(SubscriptionModel).filter(
-            SubscriptionModel.original_transaction_id == original_transaction_id
-        ).first()
+        return (await self.db.execute(
+            select(SubscriptionModel).where(
+                SubscriptionModel.original_transaction_id == original_transaction_id
+            )
+        )).scalars().first()
     
     async def create_subscription(self, subscription_data: Dict[str, Any]) -> SubscriptionModel:
         """
         Create a new subscription.
         
+        The subscription is flushed, not committed; the caller commits.
+        
         Args:
             subscription_data: The subscription data
         
@@ -128,16 +235,10 @@ class SubscriptionService:
         Raises:
             ValueError: If subscription data is invalid
         """
+        user_id = subscription_data.get("user_id")
         try:
-            # Check if user exists
-            user_id = subscription_data.get("user_id")
-            user = self.db.query(User).filter(User.id == user_id).first()
-            
-            if not user:
-                logger.error(f"Cannot create subscription: User not found: {user_id}")
-                raise ValueError(f"User not found: {user_id}")
-                
-            # Create subscription object
+            # Create subscription object; the user_id foreign key guarantees
+            # the user exists
             subscription = SubscriptionModel(
                 user_id=user_id,
                 original_transaction_id=subscription_data.get("original_transaction_id"),
@@ -150,17 +251,24 @@ class SubscriptionService:
                 raw_data=subscription_data.get("raw_data")
             )
             
-            # Save to database
+            # Flush to the database; the ID is generated client-side, so no refresh is needed
             self.db.add(subscription)
-            self.db.commit()
-            self.db.refresh(subscription)
+            await self.db.flush()
+            invalidate_subscription_status(user_id)
             
-            logger.info(f"Created subscription for user {user_id}, product {subscription.product_id}")
+            logger.info("Created subscription for user %s, product %s", user_id, subscription.product_id)
             return subscription
             
+        except IntegrityError as e:
+            await self.db.rollback()
+            if "foreign key" in str(e.orig).lower():
+                logger.error("Cannot create subscription: User not found: %s", user_id)
+                raise ValueError(f"User not found: {user_id}") from e
+            logger.error("Error creating subscription: %s", e)
+            raise ValueError(f"Failed to create subscription: {str(e)}") from e
         except Exception as e:
-            self.db.rollback()
-            logger.error(f"Error creating subscription: {str(e)}")
+            await self.db.rollback()
+            logger.error("Error creating subscription: %s", e)
             raise ValueError(f"Failed to create subscription: {str(e)}")
     
     async def update_subscription(
@@ -171,6 +279,9 @@ class SubscriptionService:
         """
         Update a subscription.
         
+        Only the columns in _UPDATABLE are changed, and None values are
+        ignored. The update is executed, not committed; the caller commits.
+        
         Args:
             subscription_id: The subscription ID
             subscription_data: The data to update
@@ -181,35 +292,41 @@ class SubscriptionService:
         Raises:
             HTTPException: If subscription is not found
         """
-        # Get the subscription
-        subscription = self.db.query(SubscriptionModel).filter(
-            SubscriptionModel.id == subscription_id
-        ).first()
-        
-        if not subscription:
-            logger.warning(f"Subscription not found: {subscription_id}")
-            raise HTTPException(
-                status_code=status.HTTP_404_NOT_FOUND,
-                detail="Subscription not found"
-            )
+        values = {
+            key: value for key, value in subscription_data.items()
+            if key in _UPDATABLE and value is not None
+        }
         
         try:
-            # Update fields
-            for key, value in subscription_data.items():
-                if hasattr(subscription, key) and value is not None:
-                    setattr(subscription, key, value)
-            
-            # Save changes
-            self.db.commit()
-            self.db.refresh(subscription)
-            
-            logger.info(f"Updated subscription {subscription_id}")
-            return subscription
-            
+            if values:
+                # Update and read back the row in a single statement. An
+                # already-loaded instance only gets the SET values applied, so
+                # updated_at is set here rather than left to its onupdate.
+                values["updated_at"] = datetime.utcnow()
+                subscription = (await self.db.execute(
+                    update(SubscriptionModel)
+                    .where(SubscriptionModel.id == subscription_id)
+                    .values(**values)
+                    .returning(SubscriptionModel)
+                )).scalar_one_or_none()
+            else:
+                subscription = await self.db.get(SubscriptionModel, subscription_id)
         except Exception as e:
-            self.db.rollback()
-            logger.error(f"Error updating subscription {subscription_id}: {str(e)}")
+            await self.db.rollback()
+            logger.error("Error updating subscription %s: %s", subscription_id, e)
             raise HTTPException(
                 status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
                 detail=f"Failed to update subscription: {str(e)}"
             )
+        
+        if not subscription:
+            logger.warning("Subscription not found: %s", subscription_id)
+            raise HTTPException(
+                status_code=status.HTTP_404_NOT_FOUND,
+                detail="Subscription not found"
+            )
+        
+        if values:
+            invalidate_subscription_status(subscription.user_id)
+            logger.info("Updated subscription %s", subscription_id)
+        return subscription
@@ -9,6 +9,8 @@ import subprocess
 import platform
 import argparse
 import shutil
+from functools import lru_cache
+from importlib.metadata import PackageNotFoundError, version as package_version
 
 # ANSI color codes for terminal output
 GREEN = '\033[0;32m'
@@ -17,22 +19,58 @@ RED = '\033[0;31m'
 BLUE = '\033[0;34m'
 NC = '\033[0m'  # No Color
 
+# Where dpkg records the state of every Debian package
+DPKG_STATUS_PATH = '/var/lib/dpkg/status'
+
 def print_colored(text, color):
     """Print text with color"""
     print(f"{color}{text}{NC}")
 
-def run_command(command, check=True):
-    """Run a shell command and return the output"""
+def run_command(command, check=True, env=None):
+    """Run a command (an argv list, without a shell) and return the output"""
     try:
-        result = subprocess.run(command, check=check, shell=True, 
-                                text=True, capture_output=True)
+        result = subprocess.run(command, check=check, text=True,
+                                capture_output=True, env=env)
         return result.stdout.strip()
+    except FileNotFoundError as e:
+        if check:
+            print_colored(f"Error running command: {e}", RED)
+        return None
     except subprocess.CalledProcessError as e:
         if check:
             print_colored(f"Error running command: {e}", RED)
             print_colored(f"Command output: {e.stderr}", RED)
         return None
 
+@lru_cache(maxsize=1)
+def installed_debian_packages():
+    """Get the names of installed Debian packages, read once from dpkg's status file"""
+    installed = set()
+    try:
+        with open(DPKG_STATUS_PATH) as f:
+            stanzas = f.read().split('\n\n')
+    except OSError:
+        return frozenset()
+    
+    for stanza in stanzas:
+        fields = dict(line.split(': ', 1) for line in stanza.splitlines()
+                      if ': ' in line and not line.startswith(' '))
+        if fields.get('Status', '').endswith(' installed') and 'Package' in fields:
+            installed.add(fields['Package'])
+    return frozenset(installed)
+
+@lru_cache(maxsize=1)
+def installed_brew_formulae():
+    """Get the names of installed Homebrew formulae, listed once"""
+    output = run_command(['brew', 'list', '--formula'], check=False)
+    return frozenset(output.split()) if output else frozenset()
+
+def apt_install(*packages):
+    """Install Debian packages with apt-get"""
+    run_command(['apt-get', 'update'])
+    run_command(['apt-get', 'install', '-y', *packages])
+    installed_debian_packages.cache_clear()
+
 def is_command_available(command):
     """Check if a command is available on the system"""
     return shutil.which(command) is not None
@@ -74,7 +112,10 @@ def check_pip():
     
     if is_command_available('pip') or is_command_available('pip3'):
         pip_cmd = 'pip3' if is_command_available('pip3') else 'pip'
-        pip_version = run_command(f"{pip_cmd} --version")
+        try:
+            pip_version = package_version('pip')
+        except PackageNotFoundError:
+            pip_version = run_command([pip_cmd, '--version'])
         print(f"pip version: {pip_version}")
         print_colored("✅ pip is installed.", GREEN)
         return True
@@ -82,7 +123,7 @@ def check_pip():
         print_colored("❌ pip is not installed!", RED)
         if is_debian_based():
             print_colored("Installing pip...", YELLOW)
-            run_command("apt-get update && apt-get install -y python3-pip")
+            apt_install('python3-pip')
             if is_command_available('pip3'):
                 print_colored("✅ pip was installed successfully.", GREEN)
                 return True
@@ -100,7 +141,7 @@ def check_venv():
         print_colored("❌ venv module is not available!", RED)
         if is_debian_based():
             print_colored("Installing python3-venv...", YELLOW)
-            run_command("apt-get update && apt-get install -y python3-venv")
+            apt_install('python3-venv')
             try:
                 import venv
                 print_colored("✅ venv module was installed successfully.", GREEN)
@@ -115,23 +156,22 @@ def check_postgres():
     
     if is_linux():
         if is_debian_based():
-            postgres_status = run_command("dpkg -l | grep postgresql", check=False)
-            if postgres_status:
+            packages = installed_debian_packages()
+            if any('postgresql' in name for name in packages):
                 print_colored("✅ PostgreSQL is installed.", GREEN)
             else:
                 print_colored("❌ PostgreSQL is not installed!", RED)
                 print_colored("Installing PostgreSQL...", YELLOW)
-                run_command("apt-get update && apt-get install -y postgresql postgresql-contrib")
+                apt_install('postgresql', 'postgresql-contrib')
                 print_colored("✅ PostgreSQL was installed.", GREEN)
             
             # Check for development libraries
-            libpq_status = run_command("dpkg -l | grep libpq-dev", check=False)
-            if libpq_status:
+            if 'libpq-dev' in packages:
                 print_colored("✅ PostgreSQL development libraries are installed.", GREEN)
             else:
                 print_colored("❌ PostgreSQL development libraries are not installed!", RED)
                 print_colored("Installing PostgreSQL development libraries...", YELLOW)
-                run_command("apt-get update && apt-get install -y libpq-dev postgresql-server-dev-all")
+                apt_install('libpq-dev', 'postgresql-server-dev-all')
                 print_colored("✅ PostgreSQL development libraries were installed.", GREEN)
             
             return True
@@ -140,17 +180,17 @@ def check_postgres():
             return False
     elif is_mac():
         if is_command_available('brew'):
-            postgres_status = run_command("brew list | grep postgresql", check=False)
-            if postgres_status:
+            if any('postgresql' in name for name in installed_brew_formulae()):
                 print_colored("✅ PostgreSQL is installed via Homebrew.", GREEN)
             else:
                 print_colored("❌ PostgreSQL is not installed via Homebrew!", RED)
                 print_colored("Installing PostgreSQL via Homebrew...", YELLOW)
-                run_command("brew install postgresql libpq")
+                run_command(['brew', 'install', 'postgresql', 'libpq'])
+                installed_brew_formulae.cache_clear()
                 print_colored("✅ PostgreSQL was installed via Homebrew.", GREEN)
                 
                 print_colored("Setting up environment for PostgreSQL...", YELLOW)
-                run_command("brew link --force libpq")
+                run_command(['brew', 'link', '--force', 'libpq'])
                 
                 # Add environment variables to shell profile
                 shell_profile = None
@@ -186,27 +226,26 @@ def check_build_tools():
     
     if is_linux():
         if is_debian_based():
-            build_essential_status = run_command("dpkg -l | grep build-essential", check=False)
-            if build_essential_status:
+            if 'build-essential' in installed_debian_packages():
                 print_colored("✅ Build tools are installed.", GREEN)
             else:
                 print_colored("❌ Build tools are not installed!", RED)
                 print_colored("Installing build tools...", YELLOW)
-                run_command("apt-get update && apt-get install -y build-essential python3-dev")
+                apt_install('build-essential', 'python3-dev')
                 print_colored("✅ Build tools were installed.", GREEN)
             return True
         else:
             print_colored("⚠️ Non-Debian Linux detected. Please install build-essential and python3-dev manually.", YELLOW)
             return False
     elif is_mac():
-        xcode_tools = run_command("xcode-select -p", check=False)
+        xcode_tools = run_command(['xcode-select', '-p'], check=False)
         if xcode_tools:
             print_colored("✅ Xcode command line tools are installed.", GREEN)
             return True
         else:
             print_colored("❌ Xcode command line tools are not installed!", RED)
             print_colored("Installing Xcode command line tools...", YELLOW)
-            run_command("xcode-select --install")
+            run_command(['xcode-select', '--install'])
             print_colored("⚠️ Please complete the Xcode installation when prompted.", YELLOW)
             return False
     else:
@@ -224,37 +263,40 @@ def check_psycopg2_installation():
     
     # Create a temporary virtual environment
     venv_dir = os.path.join(temp_dir, "venv")
-    run_command(f"python3 -m venv {venv_dir}")
+    run_command([sys.executable, '-m', 'venv', venv_dir])
     
-    # Determine the pip command based on the platform
+    # Call the venv's pip directly instead of activating the venv in a shell
     if is_linux() or is_mac():
-        pip_cmd = f"source {venv_dir}/bin/activate && pip"
+        pip_cmd = os.path.join(venv_dir, 'bin', 'pip')
     else:
-        pip_cmd = f"{venv_dir}\\Scripts\\pip"
+        pip_cmd = os.path.join(venv_dir, 'Scripts', 'pip')
     
     # Update pip and install wheel
-    run_command(f"{pip_cmd} install --upgrade pip wheel setuptools")
+    run_command([pip_cmd, 'install', '--upgrade', 'pip', 'wheel', 'setuptools'])
     
     # Try to install psycopg2-binary
     print_colored("Attempting to install psycopg2-binary...", YELLOW)
-    result = run_command(f"{pip_cmd} install psycopg2-binary", check=False)
+    result = run_command([pip_cmd, 'install', 'psycopg2-binary'], check=False)
     
     if result is None or "ERROR" in result or "error" in result:
         print_colored("❌ Failed to install psycopg2-binary directly.", RED)
         
         # Set environment variables for macOS
         if is_mac():
-            env_vars = 'LDFLAGS="-L$(brew --prefix libpq)/lib" CPPFLAGS="-I$(brew --prefix libpq)/include"'
+            libpq_prefix = run_command(['brew', '--prefix', 'libpq'], check=False) or ''
+            env = dict(os.environ,
+                       LDFLAGS=f"-L{libpq_prefix}/lib",
+                       CPPFLAGS=f"-I{libpq_prefix}/include")
             print_colored("Trying with explicit PostgreSQL paths on macOS...", YELLOW)
-            result = run_command(f"{env_vars} {pip_cmd} install psycopg2-binary", check=False)
+            result = run_command([pip_cmd, 'install', 'psycopg2-binary'], check=False, env=env)
             
             if result is None or "ERROR" in result or "error" in result:
                 print_colored("❌ Still failed with explicit paths.", RED)
                 print_colored("Trying psycopg2 instead of psycopg2-binary...", YELLOW)
-                result = run_command(f"{env_vars} {pip_cmd} install psycopg2", check=False)
+                result = run_command([pip_cmd, 'install', 'psycopg2'], check=False, env=env)
         else:
             print_colored("Trying psycopg2 instead of psycopg2-binary...", YELLOW)
-            result = run_command(f"{pip_cmd} install psycopg2", check=False)
+            result = run_command([pip_cmd, 'install', 'psycopg2'], check=False)
     
     if result is None or "ERROR" in result or "error" in result:
         print_colored("❌ All psycopg2 installation attempts failed.", RED)
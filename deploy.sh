@@ -113,6 +113,13 @@ pip install --no-cache-dir -r requirements.txt
 echo -e "\n${GREEN}Installing production dependencies...${NC}"
 pip install --no-cache-dir gunicorn uvicorn
 
+# Compile the JWS verifier with mypyc (optional: the pure-Python module is used if this fails)
+echo -e "\n${GREEN}Compiling JWS verifier...${NC}"
+pip install --no-cache-dir mypy && mypyc --ignore-missing-imports app/core/apple_jws.py || {
+    echo -e "${YELLOW}mypyc compilation failed. Using the pure-Python JWS verifier.${NC}"
+    rm -f app/core/apple_jws*.so
+}
+
 # Create keys directory if it doesn't exist
 mkdir -p "$DEPLOY_PATH/keys"
 
@@ -62,8 +62,8 @@ ssh ${SERVER_USER}@${SERVER_HOST} << EOF
 try:
     import sys
     sys.path.insert(0, '${REMOTE_PATH}')
-    from app.core.apple_jws import AppleJWSVerifier
-    print('✓ Successfully imported AppleJWSVerifier')
+    from app.core.apple_jws import verify_jws
+    print('✓ Successfully imported verify_jws')
 except Exception as e:
     print(f'✗ Error importing: {str(e)}')
 "
@@ -38,226 +38,426 @@ Apple JWS signature verification module.
 
 This module provides utilities for verifying the JWS signatures from Apple's server notifications.
 """
-import base64
-import json
+import asyncio
 import logging
-from typing import Dict, Any, Optional, List
-import requests
-from jose import jwt
+import sys
+import time
+from typing import Dict, Any, Optional, List, Tuple
+import httpx
+import orjson
+from cachetools import TTLCache
+from jose import jwk, jwt
+from jose.backends.base import Key
+from jose.exceptions import JOSEError, JWKError
 from tenacity import retry, stop_after_attempt, wait_exponential
 
-from app.core.config import settings
+try:
+    # SIMD-accelerated base64, drop-in compatible with the stdlib module
+    import pybase64 as b64
+except ImportError:  # pragma: no cover
+    import base64 as b64  # type: ignore[no-redef]
 
 logger = logging.getLogger(__name__)
 
+# Apple's public keys URL
+APPLE_PUBLIC_KEYS_URL = "https://appleid.apple.com/auth/keys"
 
-class AppleJWSVerifier:
-    """
-    Class for verifying Apple's JWS signatures.
+# How long fetched Apple public keys are trusted before being refreshed (seconds)
+PUBLIC_KEYS_TTL = 6 * 60 * 60
+
+# How often the background task refetches the keys, ahead of the cache expiring
+PUBLIC_KEYS_REFRESH_INTERVAL = PUBLIC_KEYS_TTL - 30 * 60
+
+# Unknown key IDs only trigger a refetch if the keys are older than this (seconds),
+# so tokens with a bogus kid can't make every request call Apple
+PUBLIC_KEYS_MIN_REFRESH_INTERVAL = 60
+
+# Parsed Apple public keys (kid -> (key, algorithm)), shared by all requests.
+# The lock makes concurrent cache misses wait for a single fetch.
+_keys_cache: TTLCache = TTLCache(maxsize=1, ttl=PUBLIC_KEYS_TTL)
+_keys_lock = asyncio.Lock()
+
+# When the cached keys were fetched (time.monotonic)
+_keys_fetched_at: float = 0.0
+
+# Shared HTTP client so connections to Apple are pooled and reused
+_http: Optional[httpx.AsyncClient] = None
+
+# Maps the base64url alphabet onto standard base64 before decoding
+_URLSAFE_TRANS = bytes.maketrans(b'-_', b'+/')
+
+
+def _get_http_client() -> httpx.AsyncClient:
     """
-    # Cache for Apple's public keys
-    _public_keys: Dict[str, Dict[str, Any]] = {}
+    Get the shared HTTP client, creating it on first use or after it was closed.
     
-    # Apple's public keys URL
-    APPLE_PUBLIC_KEYS_URL = "https://appleid.apple.com/auth/keys"
+    Returns:
+        httpx.AsyncClient: The shared HTTP client
+    """
+    global _http
+    if _http is None or _http.is_closed:
+        _http = httpx.AsyncClient(timeout=10, http2=True)
+    return _http
+
+
+def b64url_decode(segment: str) -> bytes:
+    """
+    Decode an unpadded base64url segment, as used in JWS tokens.
     
-    @classmethod
-    @retry(
-        stop=stop_after_attempt(3),
-        wait=wait_exponential(multiplier=1, min=1, max=10),
-        reraise=True
-    )
-    def get_apple_public_keys(cls) -> Dict[str, Dict[str, Any]]:
-        """
-        Fetch and cache Apple's public keys.
+    Args:
+        segment: The base64url-encoded segment
         
-        Returns:
-            Dict[str, Dict[str, Any]]: A dictionary of key IDs to public keys
-        """
-        if cls._public_keys:
-            return cls._public_keys
+    Returns:
+        bytes: The decoded bytes
+        
+    Raises:
+        ValueError: If the segment is not valid base64url
+    """
+    data = segment.encode('ascii')
+    # Add padding if necessary
+    pad = -len(data) & 3
+    if pad:
+        data += b'=' * pad
+    return b64.b64decode(data.translate(_URLSAFE_TRANS), validate=False)
+
+
+class JWSVerificationError(ValueError):
+    """
+    Raised when an Apple JWS token fails verification.
+    
+    Carries the token's payload decoded without verification when it could be
+    decoded, so callers that fall back to unverified payloads needn't decode the
+    token again.
+    """
+    
+    def __init__(self, message: str, payload: Optional[Dict[str, Any]] = None):
+        super().__init__(message)
+        self.payload = payload
+
+
+@retry(
+    stop=stop_after_attempt(3),
+    wait=wait_exponential(multiplier=1, min=1, max=10),
+    reraise=True
+)
+async def get_apple_public_keys(
+    force_refresh: bool = False,
+    min_age: float = 0.0
+) -> Dict[str, Tuple[Key, str]]:
+    """
+    Fetch and cache Apple's public keys.
+    
+    Each JWK is parsed into a key object once, so verification does not
+    rebuild the key on every notification. The cache expires after
+    PUBLIC_KEYS_TTL. Cache hits don't take the lock; concurrent misses
+    wait for a single fetch. With force_refresh the keys are refetched
+    unless they were fetched less than min_age seconds ago, and the cached
+    keys are only replaced once the fetch succeeds.
+    
+    Args:
+        force_refresh: Refetch the keys even if the cache is still fresh
+        min_age: With force_refresh, keep cached keys fetched this recently
+    
+    Returns:
+        Dict[str, Tuple[Key, str]]: A dictionary of key IDs to (public key, algorithm)
+    """
+    global _keys_fetched_at
+    
+    if not force_refresh:
+        cached: Optional[Dict[str, Tuple[Key, str]]] = _keys_cache.get("keys")
+        if cached is not None:
+            return cached
+    
+    async with _keys_lock:
+        # Another request may have fetched the keys while this one waited
+        cached = _keys_cache.get("keys")
+        if cached is not None:
+            if not force_refresh or time.monotonic() - _keys_fetched_at < min_age:
+                return cached
             
-        logger.info(f"Fetching Apple public keys from {cls.APPLE_PUBLIC_KEYS_URL}")
-        response = requests.get(cls.APPLE_PUBLIC_KEYS_URL, timeout=10)
+        logger.info("Fetching Apple public keys from %s", APPLE_PUBLIC_KEYS_URL)
+        response = await _get_http_client().get(APPLE_PUBLIC_KEYS_URL)
         response.raise_for_status()
         
-        keys_data = response.json()
+        keys_data = orjson.loads(response.content)
+        
+        # Process and cache keys, skipping ones without a kid or that can't be parsed
+        public_keys: Dict[str, Tuple[Key, str]] = {
+            kid: parsed
+            for key in keys_data.get("keys", ())
+            if (kid := key.get("kid")) and (parsed := _construct_key(kid, key)) is not None
+        }
         
-        # Process and cache keys
-        for key in keys_data.get("keys", []):
-            kid = key.get("kid")
-            if kid:
-                cls._public_keys[kid] = key
+        _keys_cache["keys"] = public_keys
+        _keys_fetched_at = time.monotonic()
                 
-        logger.info(f"Fetched {len(cls._public_keys)} public keys from Apple")
-        return cls._public_keys
+        logger.info("Fetched %d public keys from Apple", len(public_keys))
+        return public_keys
+
+
+def _construct_key(kid: str, key: Dict[str, Any]) -> Optional[Tuple[Key, str]]:
+    """
+    Parse one of Apple's JWKs into a key object.
     
-    @classmethod
-    def verify_jws(cls, jws_token: str) -> Dict[str, Any]:
-        """
-        Verify an Apple JWS token.
+    Args:
+        kid: The key ID
+        key: The JWK as returned by Apple
         
-        Args:
-            jws_token: The JWS token to verify
-            
-        Returns:
-            Dict[str, Any]: The decoded and verified payload
-            
-        Raises:
-            ValueError: If the token is invalid or verification fails
-        """
+    Returns:
+        Optional[Tuple[Key, str]]: The public key and its algorithm, or None if unsupported
+    """
+    alg = _key_algorithm(key)
+    try:
+        return jwk.construct(key, algorithm=alg), alg
+    except JWKError as e:
+        logger.warning("Skipping unsupported Apple public key %s: %s", kid, e)
+        return None
+
+
+def _key_algorithm(key: Dict[str, Any]) -> str:
+    """
+    Determine the signing algorithm for a JWK.
+    
+    Args:
+        key: The JWK as returned by Apple
+        
+    Returns:
+        str: The key's own "alg", otherwise one inferred from its key type
+    """
+    alg: Optional[str] = key.get("alg")
+    if alg:
+        return alg
+    if key.get("kty") == "EC":
+        return "ES256"  # Typically used with EC keys
+    return "RS256"  # Typically used with RSA keys, and the default
+
+
+async def refresh_public_keys_periodically(interval: float = PUBLIC_KEYS_REFRESH_INTERVAL) -> None:
+    """
+    Keep the public key cache warm, refetching the keys every interval.
+    
+    The first fetch happens immediately, so the first notification after
+    startup does not wait on Apple. Failures are logged and retried on the
+    next interval; the previously fetched keys stay in use meanwhile.
+    Runs until cancelled.
+    
+    Args:
+        interval: Seconds between refreshes
+    """
+    while True:
         try:
-            # Parse the token to get payload directly for App Store notifications
-            # that may not follow standard JWS format
-            parts = jws_token.split('.')
-            if len(parts) != 3:
-                raise ValueError("Invalid JWS token format")
-                
-            # Decode the payload directly for basic validation
-            payload_segment = parts[1]
-            # Add padding if necessary
-            padded_payload = payload_segment + '=' * (4 - len(payload_segment) % 4)
-            try:
-                # Try to decode the payload to make sure it's valid JSON
-                raw_payload = json.loads(base64.b64decode(padded_payload).decode('utf-8'))
-                
-                # Check if this is a standard notification format (might not have kid)
-                # App Store Server Notifications v2 has specific fields we can check
-                if "notificationType" in raw_payload or "data" in raw_payload or "summary" in raw_payload:
-                    logger.info("Detected App Store notification format, proceeding with payload extraction")
-                    return raw_payload
-            except Exception as e:
-                logger.warning(f"Failed to decode payload directly: {str(e)}")
-            
-            # Standard JWS verification with kid if the direct decode didn't succeed
-            header_segment = parts[0]
-            # Add padding if necessary
-            padded_header = header_segment + '=' * (4 - len(header_segment) % 4)
-            header_data = json.loads(base64.b64decode(padded_header).decode('utf-8'))
-            
-            kid = header_data.get("kid")
-            if not kid:
-                logger.warning("No key ID (kid) found in JWS header, attempting verification with all keys")
-                # Try all available keys since kid is not specified
-                public_keys = cls.get_apple_public_keys()
-                verification_errors = []
-                
-                for key_id, key_data in public_keys.items():
-                    try:
-                        # Determine appropriate algorithm based on key type and header
-                        key_kty = key_data.get("kty")
-                        header_alg = header_data.get("alg", "")
-                        
-                        # First check the header's alg if it's specified
-                        if header_alg:
-                            alg = header_alg
-                        # Otherwise infer from key type
-                        elif key_kty == "EC":
-                            alg = "ES256"  # Typically used with EC keys
-                        elif key_kty == "RSA":
-                            alg = "RS256"  # Typically used with RSA keys
-                        else:
-                            alg = "RS256"  # Default
-                        
-                        logger.info(f"Trying verification with key {key_id} using algorithm {alg}")
-                        
-                        payload = jwt.decode(
-                            jws_token,
-                            key_data,
-                            algorithms=[alg],
-                            options={"verify_exp": False}  # Skip expiration check for notifications
-                        )
-                        logger.info(f"Successfully verified JWS with key ID: {key_id}")
-                        return payload
-                    except Exception as e:
-                        verification_errors.append(f"Key {key_id}: {str(e)}")
-                
-                # If we get here, none of the keys worked
-                raise ValueError(f"Verification failed with all keys: {', '.join(verification_errors)}")
-                
-            # Regular flow with specified kid
-            public_keys = cls.get_apple_public_keys()
-            
-            if kid not in public_keys:
-                logger.warning(f"Key ID {kid} not found in Apple's public keys")
-                # Keys might have been updated, refresh them
-                cls._public_keys = {}
-                public_keys = cls.get_apple_public_keys()
-                
-                if kid not in public_keys:
-                    raise ValueError(f"Key ID {kid} not found in Apple's public keys")
-            
-            # Get the public key for this kid
-            key_data = public_keys[kid]
-            
-            # Determine appropriate algorithm based on key type and header
-            key_kty = key_data.get("kty")
-            header_alg = header_data.get("alg", "")
-            
-            # First check the header's alg if it's specified
-            if header_alg:
-                alg = header_alg
-            # Otherwise infer from key type
-            elif key_kty == "EC":
-                alg = "ES256"  # Typically used with EC keys
-            elif key_kty == "RSA":
-                alg = "RS256"  # Typically used with RSA keys
-            else:
-                alg = "RS256"  # Default
-                
-            logger.info(f"Verifying with key {kid} using algorithm {alg}")
-            
-            # Verify and decode the JWS token
-            payload = jwt.decode(
-                jws_token,
-                key_data,
-                algorithms=[alg],
-                options={"verify_exp": False}  # Skip expiration check for App Store notifications
-            )
-            
-            return payload
-            
+            await get_apple_public_keys(force_refresh=True)
         except Exception as e:
-            logger.error(f"Error verifying Apple JWS: {str(e)}")
-            raise ValueError(f"Failed to verify Apple JWS signature: {str(e)}")
+            logger.warning("Failed to refresh Apple public keys: %s", e)
+        await asyncio.sleep(interval)
+
+
+async def close() -> None:
+    """
+    Close the shared HTTP client used to fetch Apple's public keys.
+    """
+    global _http
+    if _http is not None:
+        await _http.aclose()
+        _http = None
+
+
+async def verify_jws(jws_token: str) -> Dict[str, Any]:
+    """
+    Verify an Apple JWS token.
     
-    @staticmethod
-    def parse_notification_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
-        """
-        Parse the notification payload from the decoded JWS.
+    The header is decoded once to find the key ID, and the token is checked
+    against that key only. Every key is tried only when the header has no kid.
+    Signatures are checked in a worker thread, off the event loop.
+    
+    Args:
+        jws_token: The JWS token to verify
         
-        Args:
-            payload: The decoded JWS payload
-            
-        Returns:
-            Dict[str, Any]: The parsed notification data
-        """
-        # Check if payload already contains notification data directly
-        if "notificationType" in payload:
-            logger.info("Found notificationType directly in payload")
-            return payload
+    Returns:
+        Dict[str, Any]: The decoded and verified payload
+        
+    Raises:
+        JWSVerificationError: If the token is invalid or verification fails
+    """
+    # Locate the segment separators rather than splitting the whole token
+    header_end = jws_token.find('.')
+    payload_end = jws_token.find('.', header_end + 1) if header_end >= 0 else -1
+    
+    try:
+        if payload_end < 0 or jws_token.find('.', payload_end + 1) >= 0:
+            raise ValueError("Invalid JWS token format")
+        
+        header_data = _decode_segment(jws_token[:header_end])
+        header_alg = header_data.get("alg")
+        
+        public_keys = await get_apple_public_keys()
+        
+        kid = header_data.get("kid")
+        if not kid:
+            logger.warning("No key ID (kid) found in JWS header, attempting verification with all keys")
+            # Trying every key is the most CPU-bound case, keep it off the event loop too
+            return await asyncio.to_thread(_decode_with_any_key, jws_token, public_keys, header_alg)
+        
+        if kid not in public_keys:
+            logger.warning("Key ID %s not found in Apple's public keys", kid)
+            # Keys might have been updated, refresh them unless that just happened
+            public_keys = await get_apple_public_keys(
+                force_refresh=True,
+                min_age=PUBLIC_KEYS_MIN_REFRESH_INTERVAL
+            )
             
-        # Standard format: extract from data field
-        notification_data = payload.get("data", {})
+            if kid not in public_keys:
+                raise ValueError(f"Key ID {kid} not found in Apple's public keys")
         
-        # If data is a string (sometimes Apple sends it as a JSON string), parse it
-        if isinstance(notification_data, str):
-            try:
-                notification_data = json.loads(notification_data)
-                logger.info("Successfully parsed notification data from string")
-            except json.JSONDecodeError:
-                logger.warning("Failed to parse notification data string as JSON")
+        key_data, key_alg = public_keys[kid]
+        alg = header_alg or key_alg
+        logger.info("Verifying with key %s using algorithm %s", kid, alg)
         
-        # Handle both v1 and v2 notification formats
-        # V1: signedRenewalInfo and signedTransactionInfo
-        # V2: data and summary fields
+        # Signature verification is CPU-bound, keep it off the event loop
+        return await asyncio.to_thread(_decode, jws_token, key_data, alg)
         
-        # Check for other common notification fields
-        for field in ["signedRenewalInfo", "signedTransactionInfo", "summary"]:
-            if field in payload and field not in notification_data:
-                notification_data[field] = payload.get(field)
-                
-        return notification_data
+    except Exception as e:
+        logger.error("Error verifying Apple JWS: %s", e)
+        unverified_payload = None
+        if payload_end >= 0:
+            unverified_payload = _decode_unverified(jws_token[header_end + 1:payload_end])
+        raise JWSVerificationError(
+            f"Failed to verify Apple JWS signature: {str(e)}",
+            payload=unverified_payload
+        )
+
+
+def _decode_segment(segment: str) -> Any:
+    """
+    Decode a base64url JWS segment into its JSON value.
+    
+    Args:
+        segment: The header or payload segment of a JWS token
+        
+    Returns:
+        Any: The decoded JSON value
+    """
+    return orjson.loads(b64url_decode(segment))
+
+
+def _decode_unverified(segment: str) -> Optional[Dict[str, Any]]:
+    """
+    Decode a JWS payload segment without checking the signature.
+    
+    Args:
+        segment: The payload segment of a JWS token
+        
+    Returns:
+        Optional[Dict[str, Any]]: The payload, or None if it is not a JSON object
+    """
+    try:
+        payload = _decode_segment(segment)
+    except ValueError as e:
+        logger.warning("Failed to decode JWS payload: %s", e)
+        return None
+    return payload if isinstance(payload, dict) else None
+
+
+def _decode_with_any_key(
+    jws_token: str,
+    public_keys: Dict[str, Tuple[Key, str]],
+    header_alg: Optional[str]
+) -> Dict[str, Any]:
+    """
+    Verify a JWS token against each public key in turn and decode its claims.
+    
+    Args:
+        jws_token: The JWS token to verify
+        public_keys: The public keys and their algorithms, by key ID
+        header_alg: The token header's alg, preferred over each key's own
+        
+    Returns:
+        Dict[str, Any]: The claims of the token, verified by the first key that matches
+        
+    Raises:
+        ValueError: If no key verifies the token
+    """
+    verification_errors: List[str] = []
+    
+    for key_id, (key_data, key_alg) in public_keys.items():
+        # Prefer the header's alg, otherwise use the key's own
+        alg = header_alg or key_alg
+        try:
+            payload = _decode(jws_token, key_data, alg)
+        except JOSEError as e:
+            verification_errors.append(f"Key {key_id}: {str(e)}")
+            continue
+        
+        logger.info("Successfully verified JWS with key ID: %s", key_id)
+        return payload
+    
+    # If we get here, none of the keys worked
+    raise ValueError(f"Verification failed with all keys: {', '.join(verification_errors)}")
+
+
+def _decode(jws_token: str, key: Key, alg: str) -> Dict[str, Any]:
+    """
+    Verify a JWS token's signature with a single key and decode its claims.
+    
+    Args:
+        jws_token: The JWS token to verify
+        key: The public key to verify with
+        alg: The signing algorithm to accept
+        
+    Returns:
+        Dict[str, Any]: The decoded and verified payload
+    """
+    claims: Dict[str, Any] = jwt.decode(
+        jws_token,
+        key,
+        algorithms=[alg],
+        options={"verify_exp": False}  # Skip expiration check for App Store notifications
+    )
+    return claims
+
+
+def parse_notification_payload(payload: Dict[str, Any]) -> Dict[str, Any]:
+    """
+    Parse the notification payload from the decoded JWS.
+    
+    Args:
+        payload: The decoded JWS payload
+        
+    Returns:
+        Dict[str, Any]: The parsed notification data
+    """
+    # Check if payload already contains notification data directly
+    if "notificationType" in payload:
+        logger.info("Found notificationType directly in payload")
+        return payload
+        
+    # Standard format: extract from data field
+    notification_data = payload.get("data", {})
+    
+    # If data is a string (sometimes Apple sends it as a JSON string), parse it
+    if isinstance(notification_data, str):
+        try:
+            notification_data = orjson.loads(notification_data)
+            logger.info("Successfully parsed notification data from string")
+        except orjson.JSONDecodeError:
+            logger.warning("Failed to parse notification data string as JSON")
+    
+    # Handle both v1 and v2 notification formats
+    # V1: signedRenewalInfo and signedTransactionInfo
+    # V2: data and summary fields
+    
+    # Check for other common notification fields
+    for field in ["signedRenewalInfo", "signedTransactionInfo", "summary"]:
+        if field in payload and field not in notification_data:
+            notification_data[field] = payload.get(field)
+            
+    return notification_data
+
+
+
+# Backward-compatible alias for code still calling AppleJWSVerifier.verify_jws(...)
+# and friends; the functions above are now accessed directly. Kept for a release.
+AppleJWSVerifier = sys.modules[__name__]
 EOL
 
 echo -e "${GREEN}Fixed indentation in apple_jws.py${NC}"
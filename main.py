@@ -1,14 +1,20 @@
 """
 Main FastAPI application entrypoint.
 """
+import asyncio
 import logging
-from fastapi import FastAPI
+from typing import Optional
+from fastapi import FastAPI, Request, status
 from fastapi.middleware.cors import CORSMiddleware
-from app.api.routes.apple_webhook import router as apple_webhook_router
+from fastapi.responses import ORJSONResponse
+from app.api.routes.apple_webhook import apple_webhook, router as apple_webhook_router
 from app.api.routes.subscriptions import router as subscriptions_router
 from app.api.routes.auth import router as auth_router
+from app.api.routes.diagnostics import router as diagnostics_router
+from app.core.apple_jws import close as close_apple_jws, refresh_public_keys_periodically
+from app.core.apple_keys import get_apple_private_key
 from app.core.config import settings
-from app.db.session import create_tables
+from app.db.session import create_tables_async
 
 # Configure logging
 logging.basicConfig(
@@ -23,6 +29,7 @@ app = FastAPI(
     version="1.0.0",
     docs_url="/api/docs",
     redoc_url="/api/redoc",
+    default_response_class=ORJSONResponse,
 )
 
 # Set up CORS
@@ -38,13 +45,71 @@ app.add_middleware(
 app.include_router(apple_webhook_router, prefix="/api/v1", tags=["webhook"])
 app.include_router(subscriptions_router, prefix="/api/v1", tags=["subscriptions"])
 app.include_router(auth_router, prefix="/api/v1", tags=["auth"])
+if settings.DEBUG or settings.ENABLE_DIAGNOSTICS:
+    app.include_router(diagnostics_router, prefix="/api/v1", tags=["diagnostics"])
+
+
+@app.exception_handler(Exception)
+async def unhandled_exception_handler(request: Request, exc: Exception) -> ORJSONResponse:
+    """
+    Handle errors not caught by the endpoints.
+    
+    Apple retries any notification that gets a non-200 response, so errors
+    while processing a notification are still acknowledged. Everything else
+    gets a generic 500.
+    
+    Args:
+        request: The request that failed
+        exc: The unhandled exception
+        
+    Returns:
+        ORJSONResponse: The error response
+    """
+    if request.scope.get("endpoint") is apple_webhook:
+        logger.exception("Error processing Apple notification: %s", exc, exc_info=exc)
+        return ORJSONResponse({"received": True}, status_code=status.HTTP_200_OK)
+    
+    logger.exception("Unhandled error on %s: %s", request.url.path, exc, exc_info=exc)
+    return ORJSONResponse(
+        {"detail": "Internal Server Error"},
+        status_code=status.HTTP_500_INTERNAL_SERVER_ERROR
+    )
+
+
+# Background task keeping Apple's public keys cached
+_keys_refresh_task: Optional[asyncio.Task] = None
 
 
 @app.on_event("startup")
 async def startup_event():
     """Initialize application on startup."""
+    global _keys_refresh_task
     logger.info("Starting Apple Subscription Service...")
-    create_tables()
+    if settings.RUN_MIGRATIONS_ON_STARTUP:
+        await create_tables_async()
+    if settings.APPLE_PRIVATE_KEY_PATH:
+        # Parse the signing key once up front; failures surface in diagnostics
+        try:
+            get_apple_private_key()
+        except (OSError, ValueError, TypeError) as e:
+            logger.warning("Could not load Apple private key: %s", e)
+    # Warm the key cache without delaying startup, then keep it fresh
+    _keys_refresh_task = asyncio.create_task(refresh_public_keys_periodically())
+
+
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Release shared resources on shutdown."""
+    global _keys_refresh_task
+    logger.info("Shutting down Apple Subscription Service...")
+    if _keys_refresh_task is not None:
+        _keys_refresh_task.cancel()
+        try:
+            await _keys_refresh_task
+        except asyncio.CancelledError:
+            pass
+        _keys_refresh_task = None
+    await close_apple_jws()
 
 
 @app.get("/health", tags=["health"])
@@ -53,104 +118,6 @@ async def health_check():
     return {"status": "ok"}
 
 
-@app.get("/api/v1/test-connection", tags=["diagnostics"])
-async def test_apple_connection():
-    """Test connection to Apple servers and check configuration."""
-    from app.services.apple_service import AppleService
-    from app.core.config import settings
-    import pkg_resources
-    import sys
-    import os
-    
-    diagnostics = {
-        "status": "ok",
-        "details": {},
-        "environment": {},
-        "dependencies": {}
-    }
-    
-    # Check environment variables
-    apple_env_vars = {
-        "APPLE_TEAM_ID": settings.APPLE_TEAM_ID,
-        "APPLE_BUNDLE_ID": settings.APPLE_BUNDLE_ID,
-        "APPLE_ENVIRONMENT": settings.APPLE_ENVIRONMENT,
-        "APPLE_PRIVATE_KEY_ID": settings.APPLE_PRIVATE_KEY_ID,
-        "APPLE_ISSUER_ID": settings.APPLE_ISSUER_ID,
-    }
-    
-    diagnostics["environment"] = {
-        "python_version": sys.version,
-        "apple_config_set": all(apple_env_vars.values()),
-        "database_url_set": bool(settings.DATABASE_URL),
-        "debug_mode": settings.DEBUG,
-    }
-    
-    # Check for key file
-    key_path = settings.APPLE_PRIVATE_KEY_PATH
-    key_exists = os.path.isfile(key_path) if key_path else False
-    diagnostics["details"]["key_file"] = {
-        "path": key_path,
-        "exists": key_exists
-    }
-    
-    # Check critical dependencies
-    critical_packages = ["fastapi", "uvicorn", "sqlalchemy", "psycopg2", "pyjwt", "cryptography"]
-    diagnostics["dependencies"] = {}
-    
-    for package in critical_packages:
-        try:
-            version = pkg_resources.get_distribution(package).version
-            diagnostics["dependencies"][package] = {
-                "installed": True,
-                "version": version
-            }
-        except pkg_resources.DistributionNotFound:
-            diagnostics["dependencies"][package] = {
-                "installed": False,
-                "version": None
-            }
-            diagnostics["status"] = "warning"
-    
-    # Test database connection
-    try:
-        from app.db.session import engine
-        from sqlalchemy import text
-        
-        with engine.connect() as conn:
-            result = conn.execute(text("SELECT 1"))
-            database_ok = result.scalar() == 1
-            
-        diagnostics["details"]["database"] = {
-            "connected": database_ok,
-            "type": settings.DATABASE_URL.split("://")[0] if settings.DATABASE_URL else "unknown"
-        }
-    except Exception as e:
-        diagnostics["details"]["database"] = {
-            "connected": False,
-            "error": str(e)
-        }
-        diagnostics["status"] = "warning"
-    
-    # Test Apple connection if everything else is OK
-    if key_exists and diagnostics["status"] == "ok":
-        try:
-            apple_service = AppleService()
-            token = apple_service.generate_token()
-            
-            diagnostics["details"]["apple_api"] = {
-                "token_generated": bool(token),
-                "environment": settings.APPLE_ENVIRONMENT
-            }
-        except Exception as e:
-            diagnostics["details"]["apple_api"] = {
-                "token_generated": False,
-                "error": str(e)
-            }
-            diagnostics["status"] = "warning"
-    
-    return diagnostics
-
-
 if __name__ == "__main__":
     import uvicorn
     
@@ -159,5 +126,7 @@ if __name__ == "__main__":
         host=settings.HOST,
         port=settings.PORT,
         reload=settings.DEBUG,
+        # uvicorn ignores workers when reloading
+        workers=settings.WORKERS,
         log_level=settings.LOG_LEVEL.lower(),
     )
@@ -0,0 +1,54 @@
+"""
+Tests for the authentication API.
+"""
+import pytest
+from passlib.hash import bcrypt
+
+from app.core import security
+from app.models.user import User
+
+
+@pytest.fixture
+async def bcrypt_user(db_session):
+    """Create a user whose password is still hashed with bcrypt."""
+    user = User(
+        email="legacy@example.com",
+        hashed_password=bcrypt.hash("password"),
+        full_name="Legacy User",
+        is_active=True
+    )
+    
+    db_session.add(user)
+    await db_session.commit()
+    
+    return user
+
+
+def test_login_upgrades_bcrypt_hash(client, bcrypt_user, monkeypatch):
+    """Test that logging in with a bcrypt hash stores an argon2 hash instead."""
+    invalidated = []
+    monkeypatch.setattr("app.api.routes.auth.invalidate_user", invalidated.append)
+    
+    response = client.post(
+        "/api/v1/subscriptions/auth",
+        data={"username": "legacy@example.com", "password": "password"}
+    )
+    
+    assert response.status_code == 200
+    assert response.json()["token_type"] == "bearer"
+    assert bcrypt_user.hashed_password.startswith("$argon2")
+    assert security.verify_password("password", bcrypt_user.hashed_password)
+    assert invalidated == [bcrypt_user.id]
+
+
+def test_login_wrong_password(client, bcrypt_user):
+    """Test that a wrong password is rejected and the hash is left alone."""
+    original_hash = bcrypt_user.hashed_password
+    
+    response = client.post(
+        "/api/v1/subscriptions/auth",
+        data={"username": "legacy@example.com", "password": "wrong"}
+    )
+    
+    assert response.status_code == 401
+    assert bcrypt_user.hashed_password == original_hash
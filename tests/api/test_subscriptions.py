@@ -0,0 +1,78 @@
+"""
+Tests for the subscriptions API.
+"""
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.core.security import create_access_token
+from app.models.subscription import Subscription, SubscriptionStatus
+
+
+def _auth_headers(user):
+    """Build a bearer token header for a user."""
+    return {"Authorization": f"Bearer {create_access_token({'sub': str(user.id)})}"}
+
+
+@pytest.fixture
+async def active_subscription(db_session, test_user):
+    """Create an active subscription for the test user."""
+    subscription = Subscription(
+        user_id=test_user.id,
+        original_transaction_id="test-original-transaction",
+        product_id="test-product",
+        status=SubscriptionStatus.ACTIVE,
+        purchase_date=datetime.utcnow(),
+        raw_data={"originalTransactionId": "test-original-transaction"}
+    )
+    
+    db_session.add(subscription)
+    await db_session.commit()
+    
+    return subscription
+
+
+def test_subscription_status(client, test_user):
+    """Test that a user can read their own subscription status from the test database."""
+    response = client.get(
+        f"/api/v1/subscriptions/status/{test_user.id}",
+        headers=_auth_headers(test_user)
+    )
+    
+    assert response.status_code == 200
+    assert response.json() == {
+        "user_id": str(test_user.id),
+        "has_active_subscription": False,
+        "subscriptions": []
+    }
+
+
+def test_subscription_status_other_user(client, test_user):
+    """Test that a user can't read another user's subscription status."""
+    response = client.get(
+        f"/api/v1/subscriptions/status/{uuid.uuid4()}",
+        headers=_auth_headers(test_user)
+    )
+    
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize("path", ["status", "active"])
+def test_raw_data_is_opt_in(client, test_user, active_subscription, path):
+    """Test that subscriptions only carry their raw payload when asked for it."""
+    url = f"/api/v1/subscriptions/{path}/{test_user.id}"
+    
+    def subscriptions(response):
+        assert response.status_code == 200
+        body = response.json()
+        return body["subscriptions"] if path == "status" else body
+    
+    default = subscriptions(client.get(url, headers=_auth_headers(test_user)))
+    included = subscriptions(client.get(
+        url, params={"include_raw_data": "true"}, headers=_auth_headers(test_user)
+    ))
+    
+    assert [s["product_id"] for s in default] == ["test-product"]
+    assert default[0]["raw_data"] is None
+    assert included[0]["raw_data"] == {"originalTransactionId": "test-original-transaction"}
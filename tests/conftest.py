@@ -1,92 +1,250 @@
 """
 Pytest configuration file.
 """
-import os
+import asyncio
+from functools import cache
+
 import pytest
-from sqlalchemy import create_engine
-from sqlalchemy.orm import sessionmaker
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
 from sqlalchemy.pool import StaticPool
 from fastapi.testclient import TestClient
 
-from app.db.session import Base, get_db
+from app.api.routes import apple_webhook
+from app.core.config import settings
+from app.db.session import Base, get_async_db
 from app.models.user import User
+from app.core import security
 from app.core.security import get_password_hash
-from main import app
+from app.services import subscription_service
+
+
+# Test database URL; the app's routes use async sessions, so the tests do too.
+# The database lives in memory, so with pytest -n every xdist worker has its own.
+TEST_DATABASE_URL = "sqlite+aiosqlite:///:memory:"
+
+# The current test's database session, served to requests by the
+# get_async_db override. A ContextVar wouldn't reach the TestClient's
+# event loop thread, nor outlive an async fixture's own context.
+_current_db_session = None
+
+
+@cache
+def hash_password(password: str) -> str:
+    """
+    Hash a test password, only once per password for the whole session.
+    
+    Hashing is deliberately slow; tests that just need a valid hash can
+    import this instead of calling get_password_hash.
+    """
+    return get_password_hash(password)
+
+
+@pytest.fixture(scope="session")
+def event_loop():
+    """Run all async fixtures and tests on one loop, shared with the session-scoped engine."""
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+@pytest.fixture(scope="session")
+def no_startup_side_effects():
+    """
+    Keep app startup from touching the configured database or Apple's servers.
+    """
+    async def no_refresh():
+        pass
+    
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setattr(settings, "RUN_MIGRATIONS_ON_STARTUP", False)
+        mp.setattr("main.refresh_public_keys_periodically", no_refresh)
+        yield
 
 
-# Test database URL
-TEST_DATABASE_URL = "sqlite:///:memory:"
+@pytest.fixture(scope="session")
+def app(no_startup_side_effects):
+    """
+    Get the FastAPI application, with startup side effects disabled.
+    
+    main is imported here rather than at the top of the test modules, so
+    test collection, and runs that only select tests without the app,
+    never build it.
+    """
+    from main import app as fastapi_app
+    return fastapi_app
 
 
 @pytest.fixture(scope="session")
-def engine():
+async def engine():
     """Create test database engine."""
-    return create_engine(
-        TEST_DATABASE_URL,
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
+    test_engine = create_async_engine(TEST_DATABASE_URL, poolclass=StaticPool)
+    
+    @event.listens_for(test_engine.sync_engine, "connect")
+    def _connect(dbapi_connection, connection_record):
+        # Let SQLAlchemy emit BEGIN itself so SAVEPOINTs work with the sqlite driver
+        dbapi_connection.isolation_level = None
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+    
+    @event.listens_for(test_engine.sync_engine, "begin")
+    def _begin(connection):
+        connection.exec_driver_sql("BEGIN")
+    
+    yield test_engine
+    await test_engine.dispose()
 
 
 @pytest.fixture(scope="session")
-def tables(engine):
+async def tables(engine):
     """Create tables in test database."""
-    Base.metadata.create_all(engine)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.create_all)
     yield
-    Base.metadata.drop_all(engine)
+    async with engine.begin() as connection:
+        await connection.run_sync(Base.metadata.drop_all)
 
 
-@pytest.fixture
-def db_session(engine, tables):
+@pytest.fixture(autouse=True)
+def clear_user_caches():
     """
-    Create a new database session for a test.
+    Start each test with empty per-user caches.
     
-    The fixture will handle cleanup and closing of the session.
+    test_user is shared by the tests of a module, so entries cached under
+    its id would otherwise outlive the rows a test rolled back.
     """
-    connection = engine.connect()
-    transaction = connection.begin()
-    session = sessionmaker(autocommit=False, autoflush=False, bind=connection)()
+    subscription_service._status_cache.clear()
+    security._token_cache.clear()
+    security._user_cache.clear()
+
+
+@pytest.fixture(scope="session")
+async def connection(engine, tables):
+    """
+    Open the connection every test runs on, in a transaction rolled back after the session.
+    
+    The in-memory database behind StaticPool has a single DBAPI connection
+    anyway, so tests and modules isolate their writes with SAVEPOINTs on
+    this connection instead of checking out their own.
+    """
+    connection = await engine.connect()
+    transaction = await connection.begin()
+    
+    yield connection
+    
+    await transaction.rollback()
+    await connection.close()
+
+
+@pytest.fixture(scope="session")
+def test_sessionmaker(connection):
+    """
+    Create the session factory bound to the test connection.
+    
+    Sessions from the factory commit and roll back SAVEPOINTs only, so they
+    never end the connection's transaction.
+    """
+    return async_sessionmaker(
+        bind=connection,
+        autoflush=False,
+        expire_on_commit=False,
+        join_transaction_mode="create_savepoint",
+    )
+
+
+@pytest.fixture(scope="module")
+async def module_db_session(connection, test_sessionmaker):
+    """
+    Create a database session for data shared by the tests of a module.
+    
+    It runs inside a SAVEPOINT rolled back after the module.
+    """
+    savepoint = await connection.begin_nested()
+    session = test_sessionmaker()
     
     yield session
     
-    session.close()
-    transaction.rollback()
-    connection.close()
+    await session.close()
+    await savepoint.rollback()
 
 
 @pytest.fixture
-def client(db_session):
+async def session_factory(connection, test_sessionmaker):
     """
-    Create a test client with a test database session.
+    Get the session factory for a test, inside a SAVEPOINT rolled back after the test.
+    
+    Everything a test writes is discarded, while module-scoped data such as
+    test_user stays in place for the next test.
     """
-    def override_get_db():
-        try:
-            yield db_session
-        finally:
-            pass
+    savepoint = await connection.begin_nested()
     
-    app.dependency_overrides[get_db] = override_get_db
+    yield test_sessionmaker
     
-    with TestClient(app) as test_client:
-        yield test_client
+    # Always roll back: tests write through several sessions and through Core
+    # statements that never show up in a session's new/dirty/deleted sets,
+    # and releasing an unused SAVEPOINT is no cheaper than rolling it back
+    await savepoint.rollback()
+
+
+@pytest.fixture
+async def db_session(session_factory):
+    """
+    Create a new database session for a test.
     
-    app.dependency_overrides.clear()
+    The fixture will handle cleanup and closing of the session.
+    """
+    global _current_db_session
+    session = session_factory()
+    _current_db_session = session
+    
+    yield session
+    
+    _current_db_session = None
+    await session.close()
+
+
+@pytest.fixture(scope="session")
+def session_client(app, test_sessionmaker):
+    """
+    Create the test client, with the database overrides installed once per session.
+    
+    Request dependencies get the current test's session, and the webhook
+    handler opens its sessions on the test connection.
+    """
+    async def override_get_async_db():
+        yield _current_db_session
+    
+    with pytest.MonkeyPatch.context() as mp:
+        mp.setitem(app.dependency_overrides, get_async_db, override_get_async_db)
+        mp.setattr(apple_webhook, "AsyncSessionLocal", test_sessionmaker)
+        with TestClient(app) as test_client:
+            yield test_client
 
 
 @pytest.fixture
-def test_user(db_session):
+def client(session_client, db_session):
+    """
+    Get the test client, serving requests the test's database session.
+    """
+    return session_client
+
+
+@pytest.fixture(scope="module")
+async def test_user(module_db_session):
     """
-    Create a test user in the database.
+    Create a test user in the database, shared by the tests of a module.
     """
     user = User(
         email="test@example.com",
-        hashed_password=get_password_hash("password"),
+        hashed_password=hash_password("password"),
         full_name="Test User",
         is_active=True
     )
     
-    db_session.add(user)
-    db_session.commit()
-    db_session.refresh(user)
+    module_db_session.add(user)
+    # Every column default is set client-side and expire_on_commit is off,
+    # so the committed user is complete without a refresh
+    await module_db_session.commit()
     
     return user
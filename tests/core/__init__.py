@@ -0,0 +1,3 @@
+"""
+Core tests package initialization.
+"""
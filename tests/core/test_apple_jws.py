@@ -0,0 +1,103 @@
+"""
+Tests for Apple JWS verification.
+"""
+import asyncio
+import json
+import threading
+import pytest
+from unittest.mock import MagicMock
+
+from jose import jwt
+from jose.exceptions import JOSEError
+
+from app.core import apple_jws
+
+
+class _FakeHTTPClient:
+    """Counts fetches of Apple's public keys, which never contain a usable key."""
+    is_closed = False
+    
+    def __init__(self):
+        self.calls = 0
+    
+    async def get(self, url):
+        self.calls += 1
+        await asyncio.sleep(0.01)
+        response = MagicMock()
+        response.content = json.dumps({"keys": []}).encode()
+        response.raise_for_status = lambda: None
+        return response
+
+
+@pytest.fixture
+def fake_http(monkeypatch):
+    """Replace the shared HTTP client and start with an empty key cache."""
+    client = _FakeHTTPClient()
+    monkeypatch.setattr(apple_jws, "_http", client)
+    # Start with a lock that no other event loop, such as a TestClient's, has used
+    monkeypatch.setattr(apple_jws, "_keys_lock", asyncio.Lock())
+    apple_jws._keys_cache.clear()
+    yield client
+    apple_jws._keys_cache.clear()
+
+
+async def test_unknown_kid_does_not_refetch_fresh_keys(fake_http):
+    """Test that tokens with an unknown kid don't refetch keys that were just fetched."""
+    token = jwt.encode({"foo": "bar"}, "secret", algorithm="HS256", headers={"kid": "bogus"})
+    
+    await apple_jws.get_apple_public_keys()
+    results = await asyncio.gather(
+        *(apple_jws.verify_jws(token) for _ in range(10)),
+        return_exceptions=True
+    )
+    
+    assert all(isinstance(result, apple_jws.JWSVerificationError) for result in results)
+    assert fake_http.calls == 1
+
+
+async def test_unknown_kid_refetches_stale_keys_once(fake_http, monkeypatch):
+    """Test that concurrent tokens with an unknown kid share one refetch of older keys."""
+    token = jwt.encode({"foo": "bar"}, "secret", algorithm="HS256", headers={"kid": "bogus"})
+    
+    await apple_jws.get_apple_public_keys()
+    monkeypatch.setattr(
+        apple_jws, "_keys_fetched_at",
+        apple_jws._keys_fetched_at - apple_jws.PUBLIC_KEYS_MIN_REFRESH_INTERVAL
+    )
+    await asyncio.gather(
+        *(apple_jws.verify_jws(token) for _ in range(10)),
+        return_exceptions=True
+    )
+    
+    assert fake_http.calls == 2
+
+
+async def test_forced_refresh_always_refetches(fake_http):
+    """Test that the background refresher's forced refresh ignores how fresh the keys are."""
+    await apple_jws.get_apple_public_keys(force_refresh=True)
+    await apple_jws.get_apple_public_keys(force_refresh=True)
+    
+    assert fake_http.calls == 2
+
+
+async def test_tokens_without_kid_are_verified_off_the_event_loop(monkeypatch):
+    """Test that trying every key for a token without a kid doesn't block the event loop."""
+    token = jwt.encode({"foo": "bar"}, "secret", algorithm="HS256")
+    decode_threads = []
+    
+    async def public_keys():
+        return {"first": (None, "ES256"), "second": (None, "ES256")}
+    
+    def failing_decode(jws_token, key, alg):
+        decode_threads.append(threading.get_ident())
+        raise JOSEError("Signature verification failed")
+    
+    monkeypatch.setattr(apple_jws, "get_apple_public_keys", public_keys)
+    monkeypatch.setattr(apple_jws, "_decode", failing_decode)
+    
+    with pytest.raises(apple_jws.JWSVerificationError) as excinfo:
+        await apple_jws.verify_jws(token)
+    
+    assert excinfo.value.payload == {"foo": "bar"}
+    assert len(decode_threads) == 2
+    assert threading.get_ident() not in decode_threads
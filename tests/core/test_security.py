@@ -0,0 +1,82 @@
+"""
+Tests for password hashing and authentication.
+"""
+from datetime import timedelta
+
+import pytest
+from fastapi import HTTPException
+from passlib.hash import bcrypt
+from sqlalchemy import delete
+
+from app.core.security import (
+    BCRYPT_MAX_BYTES,
+    MAX_PASSWORD_BYTES,
+    create_access_token,
+    get_current_user,
+    get_password_hash,
+    invalidate_user,
+    verify_and_update_password,
+    verify_password,
+)
+from app.models.user import User
+from tests.conftest import hash_password
+
+
+LONG_PASSWORD = "x" * (BCRYPT_MAX_BYTES + 8)
+
+
+def test_long_password_bytes_are_all_significant():
+    """Test that passwords longer than bcrypt's limit aren't truncated."""
+    hashed = get_password_hash(LONG_PASSWORD)
+    
+    assert verify_password(LONG_PASSWORD, hashed)
+    # Only differs after the first BCRYPT_MAX_BYTES bytes
+    assert not verify_password(LONG_PASSWORD[:-1] + "y", hashed)
+
+
+def test_legacy_long_password_hash_is_upgraded():
+    """Test that long passwords hashed before pre-hashing still verify, and get rehashed."""
+    legacy_hash = bcrypt.hash(LONG_PASSWORD)
+    
+    verified, new_hash = verify_and_update_password(LONG_PASSWORD, legacy_hash)
+    
+    assert verified
+    assert new_hash is not None and new_hash.startswith("$argon2")
+    assert verify_password(LONG_PASSWORD, new_hash)
+
+
+def test_oversized_password_is_rejected():
+    """Test that passwords over MAX_PASSWORD_BYTES are never hashed."""
+    oversized = "x" * (MAX_PASSWORD_BYTES + 1)
+    
+    assert verify_and_update_password(oversized, hash_password("password")) == (False, None)
+    with pytest.raises(ValueError):
+        get_password_hash(oversized)
+
+
+async def test_user_cache_until_invalidated(session_factory, test_user):
+    """Test that recently seen users skip the database until invalidate_user drops them."""
+    first_token, second_token, third_token = (
+        create_access_token({"sub": str(test_user.id)}, expires_delta=timedelta(minutes=minutes))
+        for minutes in (1, 2, 3)
+    )
+    
+    async with session_factory() as db:
+        assert (await get_current_user(first_token, db)).id == test_user.id
+    
+    async with session_factory() as db:
+        await db.execute(delete(User).where(User.id == test_user.id))
+        await db.commit()
+    
+    # A new token for the same user is served from the user cache
+    async with session_factory() as db:
+        assert (await get_current_user(second_token, db)).id == test_user.id
+    
+    invalidate_user(test_user.id)
+    
+    # Both the user and their cached tokens are gone
+    for token in (first_token, third_token):
+        async with session_factory() as db:
+            with pytest.raises(HTTPException) as excinfo:
+                await get_current_user(token, db)
+        assert excinfo.value.status_code == 401
@@ -0,0 +1,77 @@
+"""
+Tests for custom database types.
+"""
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select, text
+
+from app.models.subscription import Subscription, SubscriptionStatus
+from app.models.user import User
+
+# Frame magic number every zstd-compressed value starts with
+ZSTD_MAGIC = b"\x28\xb5\x2f\xfd"
+
+RAW_DATA = {"originalTransactionId": "1000", "autoRenewStatus": 1, "offers": [{"id": "a"}, None]}
+
+
+@pytest.fixture
+async def subscription(db_session, test_user):
+    """Create a subscription with raw data."""
+    subscription = Subscription(
+        user_id=test_user.id,
+        original_transaction_id="1000",
+        product_id="test-product",
+        status=SubscriptionStatus.ACTIVE,
+        purchase_date=datetime.utcnow(),
+        raw_data=RAW_DATA
+    )
+    
+    db_session.add(subscription)
+    await db_session.commit()
+    
+    return subscription
+
+
+async def _reload_raw_data(db_session, subscription):
+    """Read a subscription's raw data back from the database."""
+    db_session.expunge_all()
+    return await db_session.scalar(
+        select(Subscription.raw_data).where(Subscription.id == subscription.id)
+    )
+
+
+async def test_uuid_round_trip(db_session, test_user):
+    """Test that UUIDs are stored as 16 raw bytes on SQLite and read back as UUIDs."""
+    stored = (await db_session.execute(
+        text("SELECT typeof(id), length(id), id FROM users WHERE email = :email"),
+        {"email": test_user.email}
+    )).one()
+    
+    assert stored[0] == "blob"
+    assert stored[1] == 16
+    assert stored[2] == test_user.id.bytes
+    
+    db_session.expunge_all()
+    user = (await db_session.execute(select(User).where(User.id == test_user.id))).scalar_one()
+    assert user.id == test_user.id
+
+
+async def test_compressed_json_round_trip(db_session, subscription):
+    """Test that JSON is stored zstd-compressed and read back unchanged."""
+    stored = await db_session.scalar(
+        text("SELECT raw_data FROM subscriptions WHERE original_transaction_id = '1000'")
+    )
+    
+    assert stored.startswith(ZSTD_MAGIC)
+    assert await _reload_raw_data(db_session, subscription) == RAW_DATA
+
+
+async def test_compressed_json_reads_legacy_text(db_session, subscription):
+    """Test that uncompressed JSON text left from before compression still reads back."""
+    await db_session.execute(
+        text("UPDATE subscriptions SET raw_data = :raw_data WHERE original_transaction_id = '1000'"),
+        {"raw_data": '{"legacy": true}'}
+    )
+    
+    assert await _reload_raw_data(db_session, subscription) == {"legacy": True}
@@ -0,0 +1,22 @@
+"""
+Tests for the test database session setup.
+"""
+import pytest
+
+from app.models.user import User
+
+
+async def test_commit_only_releases_savepoint(session_factory):
+    """Test that committing a test session leaves the test's SAVEPOINT to be rolled back."""
+    connection = session_factory.kw["bind"]
+    test_savepoint = connection.get_nested_transaction()
+    
+    async with session_factory() as session:
+        session.add(User(email="savepoint@example.com", hashed_password="!"))
+        await session.flush()
+        assert connection.get_nested_transaction() != test_savepoint
+        await session.commit()
+    
+    # The commit released the session's own SAVEPOINT, not the test's
+    assert connection.get_nested_transaction() == test_savepoint
+    assert test_savepoint.is_active
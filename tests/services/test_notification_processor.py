@@ -0,0 +1,91 @@
+"""
+Tests for the notification processor.
+"""
+import time
+import pytest
+from unittest.mock import AsyncMock, patch
+
+from sqlalchemy import delete, func, select
+
+from app.core.apple_jws import JWSVerificationError
+from app.core.security import UNUSABLE_PASSWORD_HASH, verify_password
+from app.models.subscription import NotificationHistory, Subscription
+from app.models.user import User
+from app.services.notification_processor import NotificationProcessor
+
+
+def _notification(notification_uuid="test-uuid"):
+    """Build a decoded SUBSCRIBED notification."""
+    return {
+        "notificationType": "SUBSCRIBED",
+        "notificationUUID": notification_uuid,
+        "data": {"signedTransactionInfo": "header.payload.signature"}
+    }
+
+
+@pytest.fixture(scope="module")
+def verify_jws_mock():
+    """Replace verification of signed transaction info once for the module."""
+    with patch("app.services.notification_processor.verify_jws", new_callable=AsyncMock) as mock:
+        yield mock
+
+
+@pytest.fixture
+def mock_verify_jws(verify_jws_mock):
+    """Mock verification of the notification's signed transaction info."""
+    now = int(time.time() * 1000)
+    verify_jws_mock.reset_mock(return_value=True, side_effect=True)
+    verify_jws_mock.return_value = {
+        "originalTransactionId": "test-original-transaction",
+        "productId": "test-product",
+        "purchaseDate": now,
+        "expiresDate": now + 86_400_000,
+    }
+    return verify_jws_mock
+
+
+async def test_process_notification(db_session, test_user, mock_verify_jws):
+    """Test that a notification creates its subscription and history row."""
+    await NotificationProcessor(db_session).process_notification("signed", _notification())
+    
+    subscription = (await db_session.execute(select(Subscription))).scalar_one()
+    assert subscription.user_id == test_user.id
+    assert subscription.product_id == "test-product"
+    assert await db_session.scalar(select(func.count(NotificationHistory.id))) == 1
+
+
+async def test_duplicate_notification_skips_verification(db_session, test_user, mock_verify_jws):
+    """Test that a redelivered notification is dropped before any verification."""
+    await NotificationProcessor(db_session).process_notification("signed", _notification())
+    mock_verify_jws.reset_mock()
+    
+    await NotificationProcessor(db_session).process_notification("signed", _notification())
+    
+    mock_verify_jws.assert_not_called()
+    assert await db_session.scalar(select(func.count(NotificationHistory.id))) == 1
+
+
+async def test_demo_user_has_unusable_password(db_session, mock_verify_jws):
+    """Test that the placeholder user for unmapped subscriptions can't log in."""
+    # The placeholder is only created when there are no users, and the
+    # module's test_user may already exist
+    await db_session.execute(delete(User))
+    
+    await NotificationProcessor(db_session).process_notification("signed", _notification())
+    
+    user = (await db_session.execute(select(User))).scalar_one()
+    assert user.hashed_password == UNUSABLE_PASSWORD_HASH
+    assert not verify_password("demopassword", user.hashed_password)
+
+
+async def test_unverified_transaction_info_is_used(db_session, test_user, mock_verify_jws):
+    """Test that transaction info failing verification falls back to the verifier's unverified payload."""
+    mock_verify_jws.side_effect = JWSVerificationError(
+        "Failed to verify Apple JWS signature", payload=mock_verify_jws.return_value
+    )
+    
+    await NotificationProcessor(db_session).process_notification("signed", _notification())
+    
+    subscription = (await db_session.execute(select(Subscription))).scalar_one()
+    assert subscription.original_transaction_id == "test-original-transaction"
+    assert subscription.product_id == "test-product"
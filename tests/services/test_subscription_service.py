@@ -0,0 +1,99 @@
+"""
+Tests for the subscription service.
+"""
+import uuid
+from datetime import datetime
+
+import pytest
+from fastapi import HTTPException
+
+from app.models.subscription import SubscriptionStatus
+from app.services.subscription_service import SubscriptionService, _status_cache
+
+
+def _subscription_data(user, original_transaction_id="1000"):
+    """Build the data for a new active subscription."""
+    return {
+        "user_id": user.id,
+        "original_transaction_id": original_transaction_id,
+        "product_id": "test-product",
+        "status": SubscriptionStatus.ACTIVE,
+        "purchase_date": datetime.utcnow(),
+    }
+
+
+async def test_create_subscription_evicts_cached_status(db_session, test_user):
+    """Test that creating a subscription drops the user's cached status."""
+    service = SubscriptionService(db_session)
+    assert not (await service.get_user_subscription_status(test_user.id)).has_active_subscription
+    assert test_user.id in _status_cache
+    
+    await service.create_subscription(_subscription_data(test_user))
+    
+    assert test_user.id not in _status_cache
+    assert (await service.get_user_subscription_status(test_user.id)).has_active_subscription
+
+
+async def test_update_subscription_evicts_cached_status(db_session, test_user):
+    """Test that updating a subscription drops the user's cached status."""
+    service = SubscriptionService(db_session)
+    subscription = await service.create_subscription(_subscription_data(test_user))
+    assert (await service.get_user_subscription_status(test_user.id)).has_active_subscription
+    
+    await service.update_subscription(subscription.id, {"status": SubscriptionStatus.EXPIRED})
+    
+    assert test_user.id not in _status_cache
+    assert not (await service.get_user_subscription_status(test_user.id)).has_active_subscription
+
+
+async def test_update_subscription_returns_updated_row(db_session, test_user):
+    """Test that an update applies its values and returns the row in one statement."""
+    service = SubscriptionService(db_session)
+    subscription = await service.create_subscription(_subscription_data(test_user))
+    created_updated_at = subscription.updated_at
+    
+    updated = await service.update_subscription(subscription.id, {
+        "status": SubscriptionStatus.IN_GRACE_PERIOD,
+        "auto_renew_status": True,
+    })
+    
+    assert updated.id == subscription.id
+    assert updated.status == SubscriptionStatus.IN_GRACE_PERIOD
+    assert updated.auto_renew_status is True
+    assert updated.updated_at >= created_updated_at
+
+
+async def test_update_subscription_ignores_other_columns(db_session, test_user):
+    """Test that only whitelisted, non-None values are written."""
+    service = SubscriptionService(db_session)
+    subscription = await service.create_subscription(_subscription_data(test_user))
+    
+    updated = await service.update_subscription(subscription.id, {
+        "user_id": uuid.uuid4(),
+        "original_transaction_id": "other",
+        "product_id": None,
+        "environment": "Sandbox",
+    })
+    
+    assert updated.user_id == test_user.id
+    assert updated.original_transaction_id == "1000"
+    assert updated.product_id == "test-product"
+    assert updated.environment == "Sandbox"
+
+
+async def test_update_subscription_without_values(db_session, test_user):
+    """Test that an update with nothing to change returns the subscription as is."""
+    service = SubscriptionService(db_session)
+    subscription = await service.create_subscription(_subscription_data(test_user))
+    
+    assert (await service.update_subscription(subscription.id, {"user_id": uuid.uuid4()})).id == subscription.id
+
+
+async def test_update_missing_subscription(db_session):
+    """Test that updating an unknown subscription is a 404."""
+    with pytest.raises(HTTPException) as excinfo:
+        await SubscriptionService(db_session).update_subscription(
+            uuid.uuid4(), {"status": SubscriptionStatus.EXPIRED}
+        )
+    
+    assert excinfo.value.status_code == 404
@@ -45,6 +45,14 @@ ssh ${SERVER_USER}@${SERVER_HOST} << EOF
     source venv/bin/activate
     pip install -r requirements.txt
     
+    echo -e "${GREEN}Recompiling JWS verifier...${NC}"
+    # A stale extension would shadow the freshly pulled apple_jws.py
+    rm -f app/core/apple_jws*.so
+    (pip install mypy && mypyc --ignore-missing-imports app/core/apple_jws.py) || {
+        echo -e "${YELLOW}mypyc compilation failed. Using the pure-Python JWS verifier.${NC}"
+        rm -f app/core/apple_jws*.so
+    }
+    
     echo -e "${YELLOW}Restarting service...${NC}"
     supervisorctl restart apple-subscription
     
@@ -16,21 +16,20 @@ echo -e "${BLUE}============================================${NC}"
 
 # Define key code changes to check for
 APPLE_JWS_CHANGES=(
-  "key_kty = key_data.get(\"kty\")"
-  "if key_kty == \"EC\":"
-  "alg = \"ES256\""
-  "Detected App Store notification format"
+  "if key.get(\"kty\") == \"EC\":"
+  "return \"ES256\""
+  "attempting verification with all keys"
 )
 
 WEBHOOK_CHANGES=(
-  "import base64"
-  "Try to extract payload directly"
+  "Attempting to process notification despite signature verification failure"
+  "Successfully extracted payload directly from JWS"
 )
 
 NOTIFICATION_PROCESSOR_CHANGES=(
-  "import base64"
-  "direct_renewal_info = json.loads"
-  "direct_transaction_info = json.loads"
+  "except JWSVerificationError as e"
+  "Successfully extracted renewal info by direct decoding"
+  "Successfully extracted transaction info by direct decoding"
 )
 
 # Check a file for specific changes